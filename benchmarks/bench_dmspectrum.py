@@ -0,0 +1,303 @@
+#! /usr/bin/env python
+#=======================================#
+#   Benchmarks for the hot paths of     #
+#   dmspectrum and dmflux_anna          #
+#                                       #
+#   Neither ctools nor network access   #
+#   is needed.                          #
+#                                       #
+#   Usage:                              #
+#     python bench_dmspectrum.py \      #
+#       --save baseline.json            #
+#     python bench_dmspectrum.py \      #
+#       --compare baseline.json         #
+#       --tolerance 0.25                #
+#=======================================#
+import numpy as np
+from ctaAnalysis.dmspectrum.dmspectra import dmspectrum
+from ctaAnalysis.dmspectrum.dmflux import dmflux_anna
+from ctaAnalysis.dmspectrum.dmcache import DMINTERP_CACHE
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+#   Default configuration
+CHANNELS     = ( 'b' , 'Tau' , 'W' , 'Mu' )
+EW_OPTIONS   = ( True , False )
+ENERGY_SIZES = ( 10 , 100 , 1000 , 10000 , 100000 , 1000000 )
+MASS_SCANS   = ( 10 , 100 )
+REDSHIFT     = 0.018
+EBLMODEL     = 'dominguez'
+
+def measure( function , repeat=5 , number=1 ) :
+    """
+    Time a function
+
+    Parameters
+    ----------
+        function : Function without arguments
+        repeat   : Number of repetitions, the best one is kept
+        number   : Number of calls per repetition
+
+    Return
+    ------
+        Dictionary with time per call (in s) and
+        peak memory (in bytes) allocated by one call
+    """
+
+    #   Warm-up and peak memory
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[ 1 ]
+    tracemalloc.stop()
+
+    best = float( 'inf' )
+
+    for _ in range( repeat ) :
+
+        start = time.perf_counter()
+
+        for _ in range( number ) :
+
+            function()
+
+        best = min( best , ( time.perf_counter() - start ) / number )
+
+    #   Return
+    return { 'time' : best , 'peak_memory' : peak }
+
+def bench_dminterp( results , channels , ew_options ) :
+    """
+    Time creation (cold cache) and lookup (warm cache)
+    of the DM interpolators
+    """
+
+    for has_EW in ew_options :
+
+        for channel in channels :
+
+            def cold() :
+
+                DMINTERP_CACHE.clear()
+                dmspectrum._dminterp( channel , has_EW )
+
+            def warm() :
+
+                dmspectrum._dminterp( channel , has_EW )
+
+            name = 'dminterp_cold[{0},EW={1}]'.format( channel , has_EW )
+            results[ name ] = measure( cold )
+            results[ name ][ 'throughput' ] = 1. / results[ name ][ 'time' ]
+
+            name = 'dminterp_warm[{0},EW={1}]'.format( channel , has_EW )
+            results[ name ] = measure( warm , number=1000 )
+            results[ name ][ 'throughput' ] = 1. / results[ name ][ 'time' ]
+
+    #   Return
+    return
+
+def bench_ebl( results , sizes ) :
+    """
+    Time EBL attenuation with the cached
+    ebl-table model
+    """
+
+    for size in sizes :
+
+        egev = np.logspace( 1 , 5 , size )
+
+        def atten() :
+
+            dmspectrum._ebl_atten( REDSHIFT , EBLMODEL , egev )
+
+        name = 'ebl_atten[n={0}]'.format( size )
+        results[ name ] = measure( atten )
+        results[ name ][ 'throughput' ] = size / results[ name ][ 'time' ]
+
+    #   Return
+    return
+
+def bench_spectra( results , channels , ew_options , sizes ) :
+    """
+    Time dmspectrum.spectra and dmflux_anna.flux
+    for several sizes of the energy array
+    """
+
+    for has_EW in ew_options :
+
+        for channel in channels :
+
+            for size in sizes :
+
+                egev   = np.logspace( 1 , 3 , size )
+                dmspec = dmspectrum( 1000. , egev , channel , REDSHIFT ,
+                    eblmod=EBLMODEL , has_EW=has_EW )
+                dmflux = dmflux_anna( 1.e-26 , 1.e+19 , 1000. , 10. , 1000. ,
+                    channel , REDSHIFT , npoints=size , eblmod=EBLMODEL ,
+                    has_EW=has_EW )
+
+                name = 'spectra[{0},EW={1},n={2}]'.format( channel , has_EW , size )
+                results[ name ] = measure( dmspec.spectra )
+                results[ name ][ 'throughput' ] = size / results[ name ][ 'time' ]
+
+                name = 'flux[{0},EW={1},n={2}]'.format( channel , has_EW , size )
+                results[ name ] = measure( dmflux.flux )
+                results[ name ][ 'throughput' ] = size / results[ name ][ 'time' ]
+
+    #   Return
+    return
+
+def bench_mass_scan( results , channels , scans ) :
+    """
+    Time mass scans, looping over masses with spectra()
+    and in one call with spectra_grid()
+    """
+
+    egev = np.logspace( np.log10( 30. ) , 5 , 100 )
+
+    for channel in channels :
+
+        dmspec = dmspectrum( 1000. , egev , channel , REDSHIFT , eblmod=EBLMODEL )
+
+        for nmass in scans :
+
+            masses = np.logspace( 2 , 5 , nmass )
+
+            def loop() :
+
+                for mass in masses :
+
+                    dmspec.mass = mass
+                    dmspec.spectra()
+
+            def grid() :
+
+                dmspec.spectra_grid( masses , egev , xmax=0.95 )
+
+            name = 'mass_scan_loop[{0},n={1}]'.format( channel , nmass )
+            results[ name ] = measure( loop )
+            results[ name ][ 'throughput' ] = nmass / results[ name ][ 'time' ]
+
+            name = 'mass_scan_grid[{0},n={1}]'.format( channel , nmass )
+            results[ name ] = measure( grid )
+            results[ name ][ 'throughput' ] = nmass / results[ name ][ 'time' ]
+
+    #   Return
+    return
+
+def compare( results , baseline , tolerance ) :
+    """
+    Compare results with a baseline
+
+    Return
+    ------
+        List of ( name , baseline time , time ) for benchmarks
+        slower than ( 1 + tolerance ) * baseline time
+    """
+
+    regressions = []
+
+    for name , result in results.items() :
+
+        if name not in baseline :
+
+            continue
+
+        reftime = baseline[ name ][ 'time' ]
+
+        if result[ 'time' ] > ( 1. + tolerance ) * reftime :
+
+            regressions.append( ( name , reftime , result[ 'time' ] ) )
+
+    #   Return
+    return regressions
+
+def main( argv=None ) :
+
+    parser = argparse.ArgumentParser( description=( 'Benchmarks for ' +
+        'dmspectrum and dmflux_anna' ) )
+    parser.add_argument( '--channels' , nargs='+' , default=CHANNELS )
+    parser.add_argument( '--sizes' , nargs='+' , type=int , default=ENERGY_SIZES ,
+        help='Sizes of energy arrays' )
+    parser.add_argument( '--mass-scans' , nargs='+' , type=int , default=MASS_SCANS ,
+        help='Number of masses in mass scans' )
+    ewgroup = parser.add_mutually_exclusive_group()
+    ewgroup.add_argument( '--ewcorrections' , dest='ewcorrections' ,
+        action='store_true' , default=None ,
+        help=( 'Only benchmark tables with EW corrections (ewcorrections=yes ' +
+        'in csdmatter). By default, both tables are benchmarked' ) )
+    ewgroup.add_argument( '--no-ewcorrections' , dest='ewcorrections' ,
+        action='store_false' ,
+        help=( 'Only benchmark tables without EW corrections ' +
+        '(ewcorrections=no in csdmatter)' ) )
+    parser.add_argument( '--save' , default=None ,
+        help='Save results to json file' )
+    parser.add_argument( '--compare' , default=None ,
+        help='Baseline json file to compare with' )
+    parser.add_argument( '--tolerance' , type=float , default=0.25 ,
+        help='Allowed relative slowdown with respect to baseline' )
+    args = parser.parse_args( argv )
+
+    if args.ewcorrections is None :
+
+        ew_options = EW_OPTIONS
+
+    else :
+
+        ew_options = ( args.ewcorrections , )
+
+    results = {}
+
+    bench_dminterp( results , args.channels , ew_options )
+    bench_ebl( results , args.sizes )
+    bench_spectra( results , args.channels , ew_options , args.sizes )
+    bench_mass_scan( results , args.channels , args.mass_scans )
+
+    #   Report
+    width = max( len( name ) for name in results )
+
+    for name , result in results.items() :
+
+        print( '{0:<{1}s} {2:12.3e} s {3:12.3e} /s {4:10.1f} kB'.format( name ,
+            width , result[ 'time' ] , result[ 'throughput' ] ,
+            result[ 'peak_memory' ] / 1024. ) )
+
+    if args.save is not None :
+
+        output = { 'python'  : platform.python_version() ,
+                   'numpy'   : np.__version__ ,
+                   'results' : results }
+
+        with open( args.save , 'w' ) as f :
+
+            json.dump( output , f , indent=2 )
+
+    status = 0
+
+    if args.compare is not None :
+
+        with open( args.compare ) as f :
+
+            baseline = json.load( f )[ 'results' ]
+
+        regressions = compare( results , baseline , args.tolerance )
+
+        for name , reftime , newtime in regressions :
+
+            print( 'REGRESSION {0}: {1:.3e} s -> {2:.3e} s'.format( name ,
+                reftime , newtime ) )
+
+        if regressions :
+
+            status = 1
+
+    #   Return
+    return status
+
+if __name__ == '__main__' :
+
+    sys.exit( main() )
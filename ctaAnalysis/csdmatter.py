@@ -27,7 +27,14 @@ import os
 import numpy as np
 
 from ctaAnalysis.dmspectrum.dmflux import dmflux_anna
+from ctaAnalysis.dmspectrum.dmspectra import ALLOWED_CHANNELS
 import ctaAnalysis.tools.createmodels as cmodels
+import ctaAnalysis.tools.likeprofile as likeprofile
+import ctaAnalysis.tools.dmtargets as dmtargets
+import ctaAnalysis.tools.massgrid as massgrid
+import ctaAnalysis.tools.toymc as toymc
+import ctaAnalysis.tools.timing as timing
+from ctaAnalysis.tools.checkpoint import Checkpoint , run_hash , mass_key
 
 #====================================================================#
 #                                                                    #
@@ -41,6 +48,19 @@ BASEDIR = os.path.abspath( os.path.dirname( __file__ ) )
 pfiles  = os.path.join( BASEDIR , 'pfiles' )
 os.environ[ 'PFILES' ] += os.pathsep + pfiles
 
+#   Parameters that change the results of a mass point.
+#   The checkpoint of a run is keyed by a hash of their values
+#   (channels are part of the key of every record). Toys are not
+#   stored in the checkpoint, they are run again on every resume
+CHECKPOINT_PARS = ( 'inobs' , 'srcname' , 'expcube' , 'psfcube' , 'edispcube' ,
+    'bkgcube' , 'caldb' , 'irf' , 'edisp' , 'mmin' , 'mmax' , 'mnumpoints' ,
+    'process' , 'ewcorrections' , 'logsigmav' , 'logastfactor' ,
+    'redshift' , 'eblmodel' , 'emin' , 'emax' , 'modtype' , 'ra' , 'dec' ,
+    'map_fits' , 'statistic' , 'calc_ts' , 'calc_ulim' , 'fix_srcs' ,
+    'fix_bkg' , 'warmstart' , 'cache_null' , 'fastfit' , 'targets' ,
+    'asimov' , 'adaptive' , 'adapt_tol' , 'adapt_tstol' , 'adapt_maxpoints' ,
+    'eprune' , 'scan2d' , 'lsvmin' , 'lsvmax' , 'lsvnumpoints' )
+
 # =============== #
 # csdmatter class #
 # =============== #
@@ -64,6 +84,23 @@ class csdmatter( ctools.csobservation ) :
         self._binned_mode = False
         self._onoff_mode  = False
         self._nthreads    = 0
+        self._masses      = gammalib.GVector()
+        self._channels    = []
+        self._chunks      = []
+        self._warm        = {}
+        self._null        = None
+        self._fastfit     = False
+        self._scan2d      = False
+        self._asimov      = False
+        self._eprune      = False
+        self._cubes       = []
+        self._stacked     = {}
+        self._weights     = []
+        self._select      = None
+        self._checkpoint  = None
+        self._targets     = []
+        self._obs_targets = []
+        self._spectra     = []
 
         #   Return
         return
@@ -82,30 +119,66 @@ class csdmatter( ctools.csobservation ) :
         """
 
         #   Set pickled dictionary
-        state = { 'base'        : ctools.csobservation.__getstate__( self ) ,
+        #   Masses are pickled as a list of floats
+        masses = [ self._masses[ i ] for i in range( self._masses.size() ) ]
+        state  = { 'base'        : ctools.csobservation.__getstate__( self ) ,
                   'fits'        : self._fits ,
                   'binned_mode' : self._binned_mode ,
                   'onoff_mode'  : self._onoff_mode ,
-                 # 'dmass'       : self._dmass ,
-                 # 'sigmav'      : self._sigmav ,
+                  'masses'      : masses ,
+                  'channels'    : self._channels ,
+                  'chunks'      : self._chunks ,
+                  'warm'        : self._warm ,
+                  'null'        : self._null ,
+                  'fastfit'     : self._fastfit ,
+                  'scan2d'      : self._scan2d ,
+                  'asimov'      : self._asimov ,
+                  'eprune'      : self._eprune ,
+                  'cubes'       : self._cubes ,
+                  'checkpoint'  : self._checkpoint ,
+                  'targets'     : self._targets ,
+                  'obs_targets' : self._obs_targets ,
+                  'spectra'     : self._spectra ,
                   'nthreads'    : self._nthreads }
 
         #   Return dictionary
         return state
 
-    def _setstate__( self ) :
+    def __setstate__( self , state ) :
         """
-        Extend ctools.csobservation getstate method to include some members
+        Extend ctools.csobservation setstate method to include some members
         """
 
         #   Set dictionary
         ctools.csobservation.__setstate__( self , state[ 'base' ] )
 
+        self._fits        = state[ 'fits' ]
         self._binned_mode = state[ 'binned_mode' ]
         self._onoff_mode  = state[ 'onoff_mode' ]
-        # self._dmass       = state[ 'dmass' ]
-        # self._sigmav      = state[ 'sigmav' ]
         self._nthreads    = state[ 'nthreads' ]
+        self._channels    = state[ 'channels' ]
+        self._chunks      = state[ 'chunks' ]
+        self._warm        = state[ 'warm' ]
+        self._null        = state[ 'null' ]
+        self._fastfit     = state[ 'fastfit' ]
+        self._scan2d      = state[ 'scan2d' ]
+        self._asimov      = state[ 'asimov' ]
+        self._eprune      = state[ 'eprune' ]
+        self._cubes       = state[ 'cubes' ]
+        self._stacked     = {}
+        self._weights     = []
+        self._select      = None
+        self._checkpoint  = state[ 'checkpoint' ]
+        self._targets     = state[ 'targets' ]
+        self._obs_targets = state[ 'obs_targets' ]
+        self._spectra     = state[ 'spectra' ]
+
+        #   Recover GVector with masses
+        self._masses = gammalib.GVector( len( state[ 'masses' ] ) )
+
+        for index , mass in enumerate( state[ 'masses' ] ) :
+
+            self._masses[ index ] = mass
 
         #   Return
         return
@@ -153,13 +226,47 @@ class csdmatter( ctools.csobservation ) :
         self[ 'calc_ts' ].boolean()
         self[ 'fix_bkg' ].boolean()
         self[ 'fix_srcs' ].boolean()
+        self[ 'warmstart' ].boolean()
+        self[ 'cache_null' ].boolean()
+        self[ 'fastfit' ].boolean()
+        self[ 'targets' ].is_valid()
+        self[ 'asimov' ].boolean()
+        self[ 'eprune' ].boolean()
+        self[ 'ntoys' ].integer()
+
+        if self[ 'ntoys' ].integer() > 0 :
+
+            self[ 'seed' ].integer()
+
+        self[ 'scan2d' ].boolean()
+
+        if self[ 'scan2d' ].boolean() :
+
+            self[ 'lsvmin' ].real()
+            self[ 'lsvmax' ].real()
+            self[ 'lsvnumpoints' ].integer()
+
+            if self[ 'lsvmin' ].real() >= self[ 'lsvmax' ].real() :
+
+                msg = 'lsvmin must be smaller than lsvmax'
+                raise RuntimeError( msg )
 
         #   Query all dark-matter related parameters
         self[ 'mmin' ].real()
         self[ 'mmax' ].real()
         self[ 'mnumpoints' ].integer()
+        self[ 'shard' ].integer()
+        self[ 'nshards' ].integer()
+        self[ 'adaptive' ].boolean()
+
+        if self[ 'adaptive' ].boolean() :
+
+            self[ 'adapt_tol' ].real()
+            self[ 'adapt_tstol' ].real()
+            self[ 'adapt_maxpoints' ].integer()
+
         self[ 'process' ].string()
-        self[ 'channel' ].string()
+        self._get_channels()
         self[ 'ewcorrections' ].boolean()
         self[ 'logsigmav' ].real()
         self[ 'logastfactor' ].real()
@@ -183,6 +290,25 @@ class csdmatter( ctools.csobservation ) :
         #   Set mass points
         self._mlogspace()
 
+        #   Check selection of mass points
+        if self[ 'shard' ].integer() >= self[ 'nshards' ].integer() :
+
+            msg = ( 'shard ({0}) must be smaller '.format( self[ 'shard' ].integer() ) +
+                'than nshards ({0})'.format( self[ 'nshards' ].integer() ) )
+            raise RuntimeError( msg )
+
+        #   New mass points depend on all the previous ones
+        if self[ 'adaptive' ].boolean() and self[ 'nshards' ].integer() > 1 :
+
+            msg = 'Adaptive mass grid can not be split in shards'
+            raise RuntimeError( msg )
+
+        #   Checkpoint file
+        if self[ 'checkpoint' ].is_valid() :
+
+            self._checkpoint = Checkpoint( self[ 'checkpoint' ].filename().url() ,
+                self._run_hash() )
+
         # self[ 'dmass' ].real()
         # self[ 'sigmav' ].real()
 
@@ -223,8 +349,144 @@ class csdmatter( ctools.csobservation ) :
             msg = 'csdmatter only supports CTA-observations'
             raise RuntimeError( msg )
 
+        #   Joint analysis of several targets
+        if self[ 'targets' ].is_valid() :
+
+            self._set_targets()
+
+        #   Expected limits from the Asimov dataset are computed
+        #   from the predicted counts cubes
+        self._asimov = self[ 'asimov' ].boolean()
+
+        if self._asimov and not self._binned_mode :
+
+            msg = 'Asimov mode requires binned observations'
+            raise RuntimeError( msg )
+
+        #   Toys are simulated from the background cubes
+        if self[ 'ntoys' ].integer() > 0 and not self._binned_mode :
+
+            msg = 'Toy Monte Carlo requires binned observations'
+            raise RuntimeError( msg )
+
+        #   Profile likelihood with numpy is only available
+        #   for binned observations. The joint analysis of
+        #   several targets and the Asimov mode always use it
+        self._fastfit = ( self[ 'fastfit' ].boolean() or self._asimov or
+            len( self._targets ) > 0 ) and self._binned_mode
+
+        if self[ 'fastfit' ].boolean() and not self._binned_mode :
+
+            self._log_value( gammalib.TERSE , 'Warning' ,
+                'fastfit requires binned observations. Using ctlike' )
+
+        #   Likelihood surface is computed from the counts cubes
+        self._scan2d = self[ 'scan2d' ].boolean() and self._binned_mode
+
+        #   Energy range of every mass point is restricted to
+        #   [ emin , 0.95 * mass ] for binned and unbinned observations.
+        #   With energy dispersion, the DM model predicts counts above
+        #   0.95 * mass in reconstructed energy, so the range is not
+        #   restricted
+        self._eprune = self[ 'eprune' ].boolean() and not self._onoff_mode and \
+            not self[ 'edisp' ].boolean()
+
+        if self[ 'eprune' ].boolean() and self._onoff_mode :
+
+            self._log_value( gammalib.TERSE , 'Warning' ,
+                'eprune is not available for OnOff observations' )
+
+        elif self[ 'eprune' ].boolean() and self[ 'edisp' ].boolean() :
+
+            self._log_value( gammalib.TERSE , 'Warning' ,
+                'eprune is not available with energy dispersion' )
+
+        if self[ 'scan2d' ].boolean() and not self._binned_mode :
+
+            self._log_value( gammalib.TERSE , 'Warning' ,
+                'scan2d requires binned observations. Surface is not computed' )
+
+        return
+
+    def _get_channels( self ) :
+        """
+        Set list of channels from the channel parameter
+        (a channel or comma-separated list of channels)
+        """
+
+        channels = [ channel.strip() for channel in
+                     self[ 'channel' ].string().split( ',' ) if channel.strip() ]
+
+        if len( channels ) == 0 :
+
+            msg = 'At least one channel is required'
+            raise RuntimeError( msg )
+
+        for channel in channels :
+
+            if channel not in ALLOWED_CHANNELS :
+
+                msg = ( 'Channel {0} is not valid. '.format( channel ) +
+                    'Valid options are {0}'.format( ALLOWED_CHANNELS ) )
+                raise RuntimeError( msg )
+
+        #   Remove duplicates, keeping the order
+        self._channels = list( dict.fromkeys( channels ) )
+
+        #   Return
+        return
+
+    def _set_targets( self ) :
+        """
+        Read targets file and assign every observation to a
+        target (by name, or nearest target to the pointing)
+        """
+
+        if not self._binned_mode :
+
+            msg = 'Joint analysis of several targets requires binned observations'
+            raise RuntimeError( msg )
+
+        if self[ 'modtype' ].string() != 'PointSource' :
+
+            msg = 'Joint analysis of several targets only supports PointSource models'
+            raise RuntimeError( msg )
+
+        self._targets = dmtargets.read_targets( self[ 'targets' ].filename().url() )
+
+        names = [ obs.name() for obs in self.obs() ]
+        ras   = [ obs.pointing().dir().ra_deg() for obs in self.obs() ]
+        decs  = [ obs.pointing().dir().dec_deg() for obs in self.obs() ]
+
+        self._obs_targets = dmtargets.assign_targets( names , ras , decs , self._targets )
+
+        #   Log targets
+        self._log_header1( gammalib.TERSE , 'Targets' )
+
+        for t , target in enumerate( self._targets ) :
+
+            nobs  = self._obs_targets.count( t )
+            value = ( 'RA={0:.3f} DEC={1:.3f} logJ={2:.3f} '.format( target[ 'ra' ] ,
+                target[ 'dec' ] , target[ 'logj' ] ) +
+                'z={0:.4f} ({1} observations)'.format( target[ 'z' ] , nobs ) )
+            self._log_value( gammalib.TERSE , target[ 'name' ] , value )
+
+        #   Return
         return
 
+    def _run_hash( self ) :
+        """
+        Return hash of the parameters that change the
+        results of the mass points (see CHECKPOINT_PARS)
+        """
+
+        #   Current values are used, so parameters
+        #   are not queried again
+        params = { name : self[ name ].current_value() for name in CHECKPOINT_PARS }
+
+        #   Return
+        return run_hash( params )
+
     def _mlogspace( self ) :
         """
         Generate vector with points separated logarithmically.
@@ -255,14 +517,36 @@ class csdmatter( ctools.csobservation ) :
         #   Return
         return
 
-    def _gen_dmfile_anna( self , i ) :
+    def _shard_indices( self ) :
         """
-        Generate file with gamma-ray flux from
-        dark matter interactions
+        Return indices of the mass points fitted by this run.
+        Mass points are assigned to shards in round-robin, so
+        every shard gets light and heavy masses
 
         Return
         ------
-        txt file 
+        List with indices of mass points
+        """
+
+        shard   = self[ 'shard' ].integer()
+        nshards = self[ 'nshards' ].integer()
+
+        #   Return
+        return list( range( self._masses.size() ) )[ shard : : nshards ]
+
+    def _gen_dmflux_anna( self , i , channel ) :
+        """
+        Compute gamma-ray flux from dark matter
+        interactions
+
+        Parameters
+        ----------
+        i       : Index of mass point
+        channel : Annihilation channel
+
+        Return
+        ------
+        energies (in MeV) and flux (in ph/cm**2/s/MeV)
         """
 
         sigmav    = 10**( self[ 'logsigmav' ].real() )
@@ -277,7 +561,7 @@ class csdmatter( ctools.csobservation ) :
 
         #   create instance of dmspectrum class to compute flux
         dmflux = dmflux_anna( sigmav , astfactor , mass , emin , emax ,
-            self[ 'channel' ].string() , self[ 'redshift' ].real() ,
+            channel , self[ 'redshift' ].real() ,
             eblmod=self[ 'eblmodel' ].string() , has_EW=hasEW )
 
         #   Get flux
@@ -286,18 +570,19 @@ class csdmatter( ctools.csobservation ) :
         #   Get energies used to compute the flux
         energies = dmflux.energy
 
-        #   And, saving to file using numpy save
-        dummyfn = ( '{0}_dmflux_mpoint{1}.txt'.format( self[ 'srcname' ].string() , i ) )
-        data    = np.array( ( energies * 1.e+3 , dphide * 1.e-3 ) ).transpose()
-        np.savetxt( dummyfn , data , fmt='%.5e' , delimiter=' ' )
+        #   Return energies and flux in units used by gammalib
+        return energies * 1.e+3 , dphide * 1.e-3
 
-        #   Return
-        return
-
-    def _gen_model( self , i ) :
+    def _gen_model( self , energies , fluxes , tscalc=True ) :
         """
         in-fly Creation of GModel
 
+        Parameters
+        ----------
+        energies : Energies (in MeV)
+        fluxes   : Flux (in ph/cm**2/s/MeV)
+        tscalc   : Compute TS of the DM model during the fit
+
         Return
         ------
         GModel for a dark matter annihilation
@@ -317,13 +602,11 @@ class csdmatter( ctools.csobservation ) :
 
         #   Model type
         modtype  = self[ 'modtype' ].string()
-        spectype = 'FileFunction'
+        srcname  = self[ 'srcname' ].string()
 
-        #   recover filename created with _gen_dmfile_anna
-        srcname = self[ 'srcname' ].string()
-        fname   = '{0}_dmflux_mpoint{1}.txt'.format( srcname , i )
-
-        xmlspec = cmodels.dm_spectral_xml( spectype , fname ,
+        #   Spectral model is created from the numpy arrays,
+        #   so there is no file written to disk
+        dmspec   = cmodels.dm_spectral_func( energies , fluxes ,
             minval=minval , maxval=maxval )
 
         #   Now create the XML element for the extended part
@@ -335,12 +618,13 @@ class csdmatter( ctools.csobservation ) :
 
         elif self[ 'modtype' ].string() == 'DiffuseSource' :
 
-            xmlspat = dm_extended_xml( self[ 'map_fits' ].filename() )
+            xmlspat = cmodels.dm_extended_xml( self[ 'map_fits' ].filename().url() )
 
         #   Then generate GModel from GXmlElement
         #   This must avoid to create a lot of XML Templates
         #   to specify DM models :P
-        dmmod   = cmodels.DMModel( srcname , modtype , xmlspec , xmlspat )
+        dmmod   = cmodels.DMModel( srcname , modtype , dmspec , xmlspat ,
+            tscalc=tscalc )
 
         #   Return
         return dmmod.model()
@@ -379,11 +663,103 @@ class csdmatter( ctools.csobservation ) :
         return bkgmodel
 
 
-    def _fit_mass_point( self , i ) :
+    def _fit_null( self ) :
+        """
+        Fit the background-only (null) hypothesis. The null
+        hypothesis does not depend on the DM mass, so it is
+        fitted only once per run. The log-likelihood and the
+        parameters of the background model are kept in self._null
+        """
+
+        self._log_header1( gammalib.TERSE , 'Fitting background-only model' )
+
+        #   Only background model
+        models = gammalib.GModels()
+        models.append( self._gen_bkgmodel() )
+        self.obs().models( models )
+
+        #   Maximum likelihood fit via ctlike
+        like               = ctools.ctlike( self.obs() )
+        like[ 'edisp' ]    = self[ 'edisp' ].boolean()
+        like[ 'nthreads' ] = 1
+
+        #   Chatter
+        if self._logVerbose() and self._logDebug() :
+
+            like[ 'debug' ] = True
+
+        like.run()
+
+        #   gammalib returns the negative log-likelihood
+        bkgspec    = like.obs().models()[ 'CTABackgroundModel' ].spectral()
+        self._null = { 'logL'      : like.obs().logL() ,
+                       'Prefactor' : bkgspec[ 'Prefactor' ].value() ,
+                       'Index'     : bkgspec[ 'Index' ].value() ,
+                       'fit_iter'  : like.opt().iter() }
+
+        self._log_value( gammalib.TERSE , 'Null -logL' , self._null[ 'logL' ] )
+        self._log_value( gammalib.NORMAL , 'Background Prefactor' ,
+            self._null[ 'Prefactor' ] )
+        self._log_value( gammalib.NORMAL , 'Background Index' ,
+            self._null[ 'Index' ] )
+
+        #   Return
+        return
+
+    def _warm_start( self , c , i , dmmodel , bkgmodel ) :
+        """
+        Initialise DM normalization and background parameters
+        from the fit of the nearest mass point already fitted
+        (in log-mass) for the same channel (index c).
+        If there is no fitted mass point, the
+        background parameters are initialised from the
+        background-only fit (if any)
+
+        Return
+        ------
+        Dictionary with starting values of the parameters
+        """
+
+        fitted = [ key for key in self._warm if key[ 0 ] == c ]
+
+        if self[ 'warmstart' ].boolean() and len( fitted ) > 0 :
+
+            logm    = np.log10( self._masses[ i ] )
+            nearest = min( fitted , key=lambda key :
+                abs( np.log10( self._masses[ key[ 1 ] ] ) - logm ) )
+            values  = self._warm[ nearest ]
+
+            #   Normalization at the lower boundary is not
+            #   a good starting point
+            if values[ 'Normalization' ] > 0.0 :
+
+                dmmodel.spectral()[ 'Normalization' ].value( values[ 'Normalization' ] )
+
+            bkgmodel.spectral()[ 'Prefactor' ].value( values[ 'Prefactor' ] )
+            bkgmodel.spectral()[ 'Index' ].value( values[ 'Index' ] )
+
+        elif self._null is not None :
+
+            bkgmodel.spectral()[ 'Prefactor' ].value( self._null[ 'Prefactor' ] )
+            bkgmodel.spectral()[ 'Index' ].value( self._null[ 'Index' ] )
+
+        start = { 'Normalization' : dmmodel.spectral()[ 'Normalization' ].value() ,
+                  'Prefactor'     : bkgmodel.spectral()[ 'Prefactor' ].value() ,
+                  'Index'         : bkgmodel.spectral()[ 'Index' ].value() }
+
+        #   Return
+        return start
+
+    def _fit_mass_point( self , c , i ) :
         """
         Fit Model to DATA in the observation for a specific
         value of dark matter mass
 
+        Parameters
+        ----------
+        c : Index of channel
+        i : Index of mass point
+
         Return
         ------
         Result , dictionary with relevant fit results
@@ -392,7 +768,10 @@ class csdmatter( ctools.csobservation ) :
         #   Get value of mass and convert to TeV
         dmmass = 1.e-3 * self._masses[ i ]
 
-        self._log_header2( gammalib.EXPLICIT , 'Mass point ' + str( i + 1 ) )
+        channel = self._channels[ c ]
+
+        self._log_header2( gammalib.EXPLICIT , 'Mass point ' + str( i + 1 ) +
+            ' (channel ' + channel + ')' )
 
 
         #   Set reference energy for calculations
@@ -402,36 +781,58 @@ class csdmatter( ctools.csobservation ) :
         #   Well, at this moment, just annihilation :P
         self._log_header1( gammalib.TERSE , 'Compute DM model' )
 
-        if self[ 'process' ].string() == 'ANNA' :
+        signal = None
 
-            self._gen_dmfile_anna( i )
+        #   Energy layers of the counts cubes between emin
+        #   and the cutoff of the DM spectrum
+        layers = self._energy_layers( i )
 
-        #   Then create GModel containers for source and bkg
-        thisdmmodel  = self._gen_model( i )
-        thisbkgmodel = self._gen_bkgmodel()
+        if layers is not None :
 
-        #   GModels source and append dm and bkg models
-        mymodels = gammalib.GModels()
-        mymodels.append( thisdmmodel )
-        mymodels.append( thisbkgmodel )
+            self._log_value( gammalib.NORMAL , 'Energy layers' , sum(
+                layer.stop - layer.start for layer in layers ) )
 
-        #   Show mymodels in logfile, just to check that everything is Ok!
-        self._log_string( gammalib.EXPLICIT , str( mymodels ) )
+        #   Wall and CPU time of every stage
+        times = {}
+        start = timing.clock()
 
-        self._log_header1( gammalib.TERSE , 'Set or replace by Dark matter model' )
+        #   With eprune, mass points with the cutoff of the
+        #   spectrum below emin are skipped
+        skip = self._empty_range( i )
 
-        self.obs().models( mymodels )
+        if skip :
 
-        #   Now, all the analysis is the same as in csspec script
+            self._log_value( gammalib.TERSE , 'Warning' ,
+                'Mass {0:.3f} TeV: 0.95 * mass is below emin. Skipped'.format( dmmass ) )
 
-        #   Get expected dmflux at reference energy
-        #   for the source of interest
-        srcmodel = self.obs().models()[ self[ 'srcname' ].string() ]
-        srcspec  = srcmodel.spectral()
-        theoflux = srcspec.eval( eref )
+            theoflux = 0.0
 
-        #   Header
-        self._log_header1( gammalib.TERSE , 'Fitting DM Model' )
+        #   Joint analysis: predicted counts of all targets,
+        #   for a common cross-section
+        elif len( self._targets ) > 0 :
+
+            signal , theoflux = self._targets_signal( c , i , eref , layers )
+            timing.add_time( times , 'signal' , start )
+
+        else :
+
+            if self[ 'process' ].string() == 'ANNA' :
+
+                energies , fluxes = self._gen_dmflux_anna( i , channel )
+
+            #   Then create GModel containers for source and bkg
+            #   If the null hypothesis was fitted, ctlike does not
+            #   need to refit it to compute TS
+            thisdmmodel  = self._gen_model( energies , fluxes ,
+                tscalc=( self._null is None ) )
+            thisbkgmodel = self._gen_bkgmodel()
+
+            #   Get expected dmflux at reference energy
+            #   for the source of interest. This is done before
+            #   setting the starting values, so the flux
+            #   corresponds to Normalization = 1
+            theoflux = thisdmmodel.spectral().eval( eref )
+            timing.add_time( times , 'model' , start )
 
         #   So, at this moment interesting results to save are:
         #       - Reference Energy
@@ -445,7 +846,10 @@ class csdmatter( ctools.csobservation ) :
         #       - Scale factor computed to obtain the UL on sigmav
         #   This may be change when including Spectral class
         #   for DM annihilation
-        result = { 'energy'    : eref.TeV() ,
+        result = { 'channel'   : channel ,
+                   'index'     : i ,
+                   'ref_flux'  : theoflux * eref.MeV() * eref.MeV() * gammalib.MeV2erg ,
+                   'energy'    : eref.TeV() ,
                    'mass'      : dmmass ,
                    'flux'      : 0.0 ,
                    'flux_err'  : 0.0 ,
@@ -453,13 +857,91 @@ class csdmatter( ctools.csobservation ) :
                    'ulimit'    : 0.0 ,
                    'sigma_ref' : 10**( self[ 'logsigmav' ].real() ) ,
                    'sigma_lim' : 0.0 ,
-                   'sc_factor' : 0.0 }
+                   'sc_factor' : 0.0 ,
+                   'fit_iter'  : 0 ,
+                   'fit_eval'  : -1 ,
+                   'ul_steps'  : -1 ,
+                   'timing'    : times ,
+                   'start'     : {} }
+
+        #   Skipped mass points are flagged as failed
+        if skip :
+
+            result[ 'ulimit' ]    = -1.0
+            result[ 'sc_factor' ] = -1.0
+            result[ 'sigma_lim' ] = -1.0
+
+            if self._scan2d :
+
+                result[ 'loglsurface' ] = [ 0.0 ] * self._lsv_grid().size
+
+            if self._asimov :
+
+                result[ 'sigma_bands' ] = { key : 0.0 for key in
+                                            ( 'median' , 'p1s' , 'm1s' , 'p2s' , 'm2s' ) }
+
+            #   Return
+            return result
+
+        #   Predicted counts of the DM model for Normalization = 1
+        if signal is None and ( self._fastfit or self._scan2d ) :
+
+            start  = timing.clock()
+            signal = self._signal_counts( thisdmmodel , layers )
+            timing.add_time( times , 'signal' , start )
+
+        #   Likelihood surface over ( mass , log10( sigmav ) )
+        if self._scan2d :
+
+            start = timing.clock()
+            result[ 'loglsurface' ] = self._logl_surface( signal , layers )
+            timing.add_time( times , 'like' , start )
+
+        #   Profile likelihood computed with numpy
+        if self._fastfit :
+
+            self._fast_fit( result , signal , eref , theoflux , layers )
+
+            #   Return
+            return result
+
+        #   Starting values of the fit
+        start             = self._warm_start( c , i , thisdmmodel , thisbkgmodel )
+        result[ 'start' ] = start
+
+        #   GModels source and append dm and bkg models
+        mymodels = gammalib.GModels()
+        mymodels.append( thisdmmodel )
+        mymodels.append( thisbkgmodel )
+
+        #   Show mymodels in logfile, just to check that everything is Ok!
+        self._log_string( gammalib.EXPLICIT , str( mymodels ) )
+
+        self._log_header1( gammalib.TERSE , 'Set or replace by Dark matter model' )
+
+        self.obs().models( mymodels )
+
+        #   Events (or layers of counts cubes) between emin
+        #   and the cutoff of the DM spectrum
+        obs = self.obs()
+
+        if self._eprune :
+
+            start = timing.clock()
+            obs   = self._select_obs( gammalib.GEnergy( self[ 'emin' ].real() , 'GeV' ) ,
+                gammalib.GEnergy( 0.95 * self._masses[ i ] , 'GeV' ) )
+            timing.add_time( times , 'like' , start )
+
+        #   Now, all the analysis is the same as in csspec script
+
+        #   Header
+        self._log_header1( gammalib.TERSE , 'Fitting DM Model' )
 
         #   Header for ctlike instance :)
         self._log_header3( gammalib.EXPLICIT , 'Performing likelihood fit for mass point' )
 
         #   Maximum likelihood fit via ctlike
-        like               = ctools.ctlike( self.obs() )
+        like               = ctools.ctlike( obs )
         like[ 'edisp' ]    = self[ 'edisp' ].boolean()
         like[ 'nthreads' ] = 1
 
@@ -468,21 +950,59 @@ class csdmatter( ctools.csobservation ) :
 
             like[ 'debug' ] = True
 
-        like.run()
+        start = timing.clock()
+
+        try :
+
+            like.run()
+
+        finally :
+
+            #   ctlike works on its own copy of the observations,
+            #   so masked weights are restored after the fit
+            if self._eprune :
+
+                self._restore_obs()
+
+        timing.add_time( times , 'like' , start )
 
         #   Extract fit results
         model    = like.obs().models()[ self[ 'srcname' ].string() ]
         spectrum = model.spectral()
         logL0    = like.obs().logL()
 
+        #   Number of iterations of the optimizer. The number of
+        #   function evaluations and of steps of ctulimit are not
+        #   available, so fit_eval and ul_steps are -1
+        result[ 'fit_iter' ] = like.opt().iter()
+
+        self._log_value( gammalib.NORMAL , 'Optimizer iterations' , result[ 'fit_iter' ] )
+        self._log_value( gammalib.EXPLICIT , 'Starting values' , str( start ) )
+
+        #   Keep converged values for warm starts
+        bkgspec = like.obs().models()[ 'CTABackgroundModel' ].spectral()
+        self._warm[ ( c , i ) ] = { 'Normalization' : spectrum[ 'Normalization' ].value() ,
+                                    'Prefactor'     : bkgspec[ 'Prefactor' ].value() ,
+                                    'Index'         : bkgspec[ 'Index' ].value() }
+
         #   Write models results
         self._log_string( gammalib.EXPLICIT , str( like.obs().models() ) )
 
         #   Continue only if logL0 is different from zero
         if logL0 != 0.0 :
 
-            #   Extract TS value
-            result[ 'TS' ] = model.ts()
+            #   Extract TS value. With a cached null hypothesis,
+            #   TS = 2 * ( logL_null - logL ), where both logL are
+            #   negative log-likelihoods as returned by gammalib
+            if self._null is not None :
+
+                if self[ 'calc_ts' ].boolean() :
+
+                    result[ 'TS' ] = 2.0 * ( self._null[ 'logL' ] - logL0 )
+
+            else :
+
+                result[ 'TS' ] = model.ts()
 
             #   Calculation of upper-limit via ctulimit
             ulimit_value = -1.0
@@ -504,6 +1024,8 @@ class csdmatter( ctools.csobservation ) :
                     ulimit[ 'debug' ] = True
 
                 #    Catching exceptions
+                start = timing.clock()
+
                 try :
 
                     ulimit.run()
@@ -514,6 +1036,8 @@ class csdmatter( ctools.csobservation ) :
                     self._log_string( gammalib.EXPLICIT , 'UL Calculation failed :(' )
                     ulimit_value = -1.0
 
+                timing.add_time( times , 'ulimit' , start )
+
                 #   Compute quantities related to ulimit
 
                 if ulimit_value > 0.0 :
@@ -552,95 +1076,1088 @@ class csdmatter( ctools.csobservation ) :
                 result[ 'flux_err' ] = e_flux      * eref2 * gammalib.MeV2erg
 
                 #   Logging
-                value = '%e +/- %e' % ( result[ 'flux' ] , result[ 'flux_err' ] )
-                svmsg = ''
+                self._log_result( result )
 
-                if self[ 'calc_ulim' ].boolean() and result[ 'ulimit' ] > 0.0 :
+        #   If logL0 == 0, then failed :(
+        #   but, this does not raise any error
+        else :
 
-                    value += ' [< %e]' % ( result[ 'ulimit' ] )
-                    svmsg += ' [%e]' % ( result[ 'sc_factor' ] )
+            value = 'Likelihood is zero. Something is weird. Check model'
+            self._log_value( gammalib.TERSE , 'Warning: ' , value )
 
-                value += ' erg/cm**2/s'
+        #   Return
+        return result
 
-                if self[ 'calc_ts' ].boolean() and result[ 'TS' ] > 0.0:
+    def _log_result( self , result ) :
+        """
+        Write flux, upper limit, TS and scale factor
+        of a mass point into logger
+        """
 
-                    value += ' (TS = %.3f)' % ( result[ 'TS' ] )
+        value = '%e +/- %e' % ( result[ 'flux' ] , result[ 'flux_err' ] )
+        svmsg = ''
 
-                self._log_value( gammalib.TERSE , 'Flux' , value )
+        if self[ 'calc_ulim' ].boolean() and result[ 'ulimit' ] > 0.0 :
 
-                if len( svmsg ) > 0 :
+            value += ' [< %e]' % ( result[ 'ulimit' ] )
+            svmsg += ' [%e]' % ( result[ 'sc_factor' ] )
 
-                    self._log_value( gammalib.TERSE , 'ScaleFactor' , svmsg )
+        value += ' erg/cm**2/s'
 
-        #   If logL0 == 0, then failed :(
-        #   but, this does not raise any error
-        else :
+        if self[ 'calc_ts' ].boolean() and result[ 'TS' ] > 0.0:
 
-            value = 'Likelihood is zero. Something is weird. Check model'
-            self._log_value( gammalib.TERSE , 'Warning: ' , value )
+            value += ' (TS = %.3f)' % ( result[ 'TS' ] )
+
+        self._log_value( gammalib.TERSE , 'Flux' , value )
+
+        if len( svmsg ) > 0 :
+
+            self._log_value( gammalib.TERSE , 'ScaleFactor' , svmsg )
 
         #   Return
-        return result
+        return
 
-    def _fit_mass_points( self ) :
+    @staticmethod
+    def _skymap_array( skymap ) :
         """
-        Fit for GVector masses
+        Copy pixels of a GSkyMap into a numpy array. Pixels
+        are copied in bulk with GSkyMap.array(), which stores
+        every map in pixel order (pix = ix + nx * iy)
 
         Return
         ------
-        results: dictionary with result for every mass point
+        Array with shape ( nmaps , npix )
         """
 
-        self._log_header1( gammalib.TERSE , 'Fitting models for different masses' )
-        self._log_string( gammalib.TERSE, str( self._masses ) )
+        npix  = skymap.npix()
+        nmaps = skymap.nmaps()
 
-        # Initialise results
-        results = []
+        #   Return
+        return np.asarray( skymap.array() , dtype=float ).reshape( nmaps , npix )
+
+    def _model_counts( self , obs , models , layers=None ) :
+        """
+        Compute predicted counts of models for a binned observation
 
-        #   I need to check how to use multiprocessing
-        #   I hope, this is not caused by a bug in the code
-        if self._nthreads > 1:
+        Parameters
+        ----------
+        obs    : Binned observation (GCTAObservation)
+        models : GModels container
+        layers : Slice of energy layers. By default, all layers
 
-            #   force to set nthreads to one
+        Return
+        ------
+        Array with shape ( nebins , npix ), or ( number of
+        layers in slice , npix )
+        """
 
-            self._nthreads = 1
-            # Compute energy bins
-            # args        = [ ( self, '_fit_mass_point', i )
-            #                for i in range( self._masses.size() ) ]
-            # poolresults = mputils.process( self._nthreads , mputils.mpfunc , args )
+        cube = obs.events()
 
-            # # Construct results
-            # for i in range( self._masses.size() ) :
+        if layers is not None :
 
-            #     results.append( poolresults[ i ][ 0 ] )
-            #     self._log_string( gammalib.TERSE ,
-            #         poolresults[ i ][ 1 ][ 'log' ] , False )
+            if layers.stop <= layers.start :
 
-        # Otherwise, loop over energy bins
-        # else:
-        for i in range( self._masses.size() ) :
+                return np.zeros( ( 0 , cube.npix() ) )
 
-            # Fit energy bin
-            result = self._fit_mass_point( i )
+            cube = self._pruned_cube( cube , layers )
 
-            # Append results
-            results.append( result )
+        container = gammalib.GObservations()
+        container.append( obs )
+        container.models( models )
 
-        # Return results
-        return results
+        model            = ctools.ctmodel( container )
+        model.cube( cube )
+        model[ 'edisp' ] = self[ 'edisp' ].boolean()
+        model.run()
 
+        #   Return
+        return self._skymap_array( model.cube().counts() )
 
-    def _create_fits( self , results ) :
+    def _prepare_cubes( self ) :
         """
-        Create fits file
-
-        Parameters
-        ----------
-        result: Dictionary with results obtained from fit
+        Store counts, weights and predicted background counts
+        of every binned observation. The background model does
+        not depend on the DM mass, so the cubes are computed
+        once per run (with the parameters of the null fit,
+        if available)
+        """
+
+        self._log_header1( gammalib.TERSE , 'Computing background cubes' )
+
+        bkgmodel = self._gen_bkgmodel()
+
+        if self._null is not None :
+
+            bkgmodel.spectral()[ 'Prefactor' ].value( self._null[ 'Prefactor' ] )
+            bkgmodel.spectral()[ 'Index' ].value( self._null[ 'Index' ] )
+
+        models = gammalib.GModels()
+        models.append( bkgmodel )
+
+        self._cubes   = []
+        self._stacked = {}
+
+        for obs in self.obs() :
+
+            cube       = obs.events()
+            background = self._model_counts( obs , models )
+
+            #   Asimov dataset: counts are the expected counts
+            #   of the background-only hypothesis
+            if self._asimov :
+
+                counts = background.copy()
+
+            else :
+
+                counts = self._skymap_array( cube.counts() )
+
+            #   Energy boundaries of layers (in GeV)
+            ebounds = cube.ebounds()
+            nlayers = ebounds.size()
+            elow    = np.array( [ ebounds.emin( k ).GeV() for k in range( nlayers ) ] )
+            ehigh   = np.array( [ ebounds.emax( k ).GeV() for k in range( nlayers ) ] )
+
+            self._cubes.append( { 'counts'     : counts ,
+                                  'weights'    : self._skymap_array( cube.weights() ) ,
+                                  'background' : background ,
+                                  'elow'       : elow ,
+                                  'ehigh'      : ehigh } )
+
+        nbins = sum( cube[ 'counts' ].size for cube in self._cubes )
+        self._log_value( gammalib.NORMAL , 'Number of bins' , nbins )
+
+        #   Return
+        return
+
+    def _stacked_cubes( self , key , layers=None ) :
+        """
+        Return values of key ( counts , weights or background )
+        of all binned observations in a flat array
+
+        Parameters
+        ----------
+        key    : Name of cube
+        layers : List with a slice of energy layers for every
+                 observation (see _energy_layers). By default,
+                 all layers
+        """
+
+        #   Cubes of all layers do not change during the scan,
+        #   so they are stacked only once
+        if layers is None :
+
+            if key not in self._stacked :
+
+                self._stacked[ key ] = np.concatenate( [ cube[ key ].ravel()
+                                                         for cube in self._cubes ] )
+
+            return self._stacked[ key ]
+
+        #   Slices of the first axis are views of the cubes, so
+        #   only the selected layers are copied
+        stacked = np.concatenate( [ cube[ key ][ layer ].ravel()
+                                    for cube , layer in zip( self._cubes , layers ) ] )
+
+        #   Return
+        return stacked
+
+    def _energy_layers( self , i ) :
+        """
+        Select the energy layers of every binned observation
+        overlapping the energy range of the DM spectrum of
+        mass point i, [ emin , 0.95 * mass ]. The DM model
+        does not predict counts outside this range (without
+        energy dispersion), so the other layers are ignored
+
+        Parameters
+        ----------
+        i : Index of mass point
+
+        Return
+        ------
+        List with a slice of layers for every binned
+        observation, or None if eprune is False
+        """
+
+        if not self._eprune or len( self._cubes ) == 0 :
+
+            return None
+
+        emin   = self[ 'emin' ].real()
+        emax   = 0.95 * self._masses[ i ]
+        layers = [ self._layer_range( cube[ 'elow' ] , cube[ 'ehigh' ] , emin , emax )
+                   for cube in self._cubes ]
+
+        #   Return
+        return layers
+
+    def _empty_range( self , i ) :
+        """
+        Return True if eprune is set and the cutoff of the
+        DM spectrum of mass point i, 0.95 * mass, is not
+        above emin (no energy range is left to fit)
+        """
+
+        #   Return
+        return self._eprune and 0.95 * self._masses[ i ] <= self[ 'emin' ].real()
+
+    @staticmethod
+    def _layer_range( elow , ehigh , emin , emax ) :
+        """
+        Slice of energy layers overlapping [ emin , emax ]
+
+        Parameters
+        ----------
+        elow  : Array with lower energy of layers
+        ehigh : Array with upper energy of layers
+        emin  : Minimum energy (same units as elow)
+        emax  : Maximum energy (same units as elow)
+
+        Return
+        ------
+        Slice of layers, slice( 0 , 0 ) if no layer overlaps
+        """
+
+        keep = np.where( ( np.asarray( ehigh ) > emin ) &
+                         ( np.asarray( elow ) < emax ) )[ 0 ]
+
+        if keep.size == 0 :
+
+            return slice( 0 , 0 )
+
+        #   Return
+        return slice( int( keep[ 0 ] ) , int( keep[ -1 ] ) + 1 )
+
+    @staticmethod
+    def _pruned_cube( cube , layers ) :
+        """
+        Create counts cube with a slice of the energy layers
+        of cube. Only the selected layers are copied
+
+        Parameters
+        ----------
+        cube   : GCTAEventCube
+        layers : Slice of energy layers
+
+        Return
+        ------
+        GCTAEventCube
+        """
+
+        nlayers = layers.stop - layers.start
+        ebounds = gammalib.GEbounds()
+
+        for k in range( layers.start , layers.stop ) :
+
+            ebounds.append( cube.ebounds().emin( k ) , cube.ebounds().emax( k ) )
+
+        counts  = cube.counts().extract( layers.start , nlayers )
+        weights = cube.weights().extract( layers.start , nlayers )
+
+        #   Return
+        return gammalib.GCTAEventCube( counts , weights , ebounds , cube.gti() )
+
+    def _select_obs( self , emin , emax ) :
+        """
+        Select events (unbinned observations) or mask layers
+        of counts cubes (binned observations) in an energy
+        interval, as done by csspec
+
+        Binned observations are not copied: layers outside
+        [ emin , emax ] get zero weight in the counts cubes of
+        the input observations, so ctlike skips their bins.
+        Weights are restored by _restore_obs. Events of
+        unbinned observations are selected by ctselect, which
+        is kept until _restore_obs is called
+
+        Parameters
+        ----------
+        emin : Minimum energy (GEnergy)
+        emax : Maximum energy (GEnergy)
+
+        Return
+        ------
+        GObservations with models of the input observations
+        """
+
+        if self._binned_mode :
+
+            self._log_header3( gammalib.EXPLICIT , 'Masking cube layers' )
+
+            #   Weights of the input cubes are kept once
+            if len( self._weights ) == 0 :
+
+                self._weights = [ obs.events().weights().copy() for obs in self.obs() ]
+
+            for obs , weights in zip( self.obs() , self._weights ) :
+
+                cube    = obs.events()
+                ebounds = cube.ebounds()
+                nlayers = ebounds.size()
+                layers  = self._layer_range(
+                    [ ebounds.emin( k ).GeV() for k in range( nlayers ) ] ,
+                    [ ebounds.emax( k ).GeV() for k in range( nlayers ) ] ,
+                    emin.GeV() , emax.GeV() )
+
+                masked = weights.copy()
+
+                for k in range( nlayers ) :
+
+                    if layers.start <= k < layers.stop :
+
+                        continue
+
+                    for pixel in range( masked.npix() ) :
+
+                        masked[ pixel , k ] = 0.0
+
+                cube.weights( masked )
+
+            obs = self.obs()
+
+        else :
+
+            self._log_header3( gammalib.EXPLICIT , 'Selecting events' )
+
+            #   Only events in [ emin , emax ] are copied
+            select           = ctools.ctselect( self.obs() )
+            select[ 'ra' ]   = 'UNDEFINED'
+            select[ 'dec' ]  = 'UNDEFINED'
+            select[ 'rad' ]  = 'UNDEFINED'
+            select[ 'emin' ] = emin.TeV()
+            select[ 'emax' ] = emax.TeV()
+            select[ 'tmin' ] = 'UNDEFINED'
+            select[ 'tmax' ] = 'UNDEFINED'
+
+            if self._logVerbose() and self._logDebug() :
+
+                select[ 'debug' ] = True
+
+            select.run()
+
+            #   The container is owned by ctselect,
+            #   so the tool is kept alive
+            self._select = select
+            obs          = select.obs()
+
+        #   Return
+        return obs
+
+    def _restore_obs( self ) :
+        """
+        Restore weights of the counts cubes masked by
+        _select_obs and release the selected events
+        """
+
+        for obs , weights in zip( self.obs() , self._weights ) :
+
+            obs.events().weights( weights )
+
+        self._select = None
+
+        #   Return
+        return
+
+    def _signal_counts( self , dmmodel , layers=None ) :
+        """
+        Compute predicted counts of the DM model in all
+        binned observations
+
+        Parameters
+        ----------
+        dmmodel : GModel of the DM source
+        layers  : List with a slice of energy layers for every
+                  observation (see _energy_layers). By default,
+                  all layers
+
+        Return
+        ------
+        Flat array, with the same order as _stacked_cubes
+        """
+
+        models = gammalib.GModels()
+        models.append( dmmodel )
+
+        if layers is None :
+
+            layers = [ None ] * self.obs().size()
+
+        signal = [ self._model_counts( obs , models , layer ).ravel()
+                   for obs , layer in zip( self.obs() , layers ) ]
+
+        #   Return
+        return np.concatenate( signal )
+
+    def _gen_target_model( self , t ) :
+        """
+        Create GModel of target t (point source at the
+        position of the target) from the spectrum in
+        self._spectra
+        """
+
+        target            = self._targets[ t ]
+        energies , fluxes = self._spectra[ t ]
+
+        dmspec  = cmodels.dm_spectral_func( energies , fluxes ,
+            minval=0.0 , maxval=1.e+10 )
+        xmlspat = cmodels.dm_pointsource_xml( target[ 'ra' ] , target[ 'dec' ] )
+        dmmod   = cmodels.DMModel( target[ 'name' ] , 'PointSource' , dmspec ,
+            xmlspat , tscalc=False )
+
+        #   Return
+        return dmmod.model()
+
+    def _target_signal( self , task ) :
+        """
+        Compute predicted counts of target t in the
+        observations assigned to the target
+
+        Parameters
+        ----------
+        task : Pair ( index of target t , list with a slice
+               of energy layers for every observation or None )
+
+        Return
+        ------
+        Dictionary { index of observation : flat array }
+        """
+
+        t , layers = task
+
+        models = gammalib.GModels()
+        models.append( self._gen_target_model( t ) )
+
+        if layers is None :
+
+            layers = [ None ] * self.obs().size()
+
+        signal = {}
+
+        for k , obs in enumerate( self.obs() ) :
+
+            if self._obs_targets[ k ] == t :
+
+                signal[ k ] = self._model_counts( obs , models , layers[ k ] ).ravel()
+
+        #   Return
+        return signal
+
+    def _targets_signal( self , c , i , eref , layers=None ) :
+        """
+        Compute predicted counts of all targets for the
+        reference cross-section. The spectrum is computed once
+        per redshift and rescaled by the J-factor of every
+        target. Predicted counts of the targets are computed
+        in parallel processes
+
+        Parameters
+        ----------
+        c      : Index of channel
+        i      : Index of mass point
+        eref   : Reference energy
+        layers : List with a slice of energy layers for every
+                 observation (see _energy_layers). By default,
+                 all layers
+
+        Return
+        ------
+        signal   : Flat array, with the same order as _stacked_cubes
+        theoflux : Sum of the differential fluxes of the
+                   targets at eref
+        """
+
+        mass      = self._masses[ i ]
+        sigmav    = 10**( self[ 'logsigmav' ].real() )
+        redshifts = np.array( [ target[ 'z' ] for target in self._targets ] )
+        jfactors  = np.power( 10. , [ target[ 'logj' ] for target in self._targets ] )
+
+        self._spectra = [ None ] * len( self._targets )
+
+        for z in np.unique( redshifts ) :
+
+            sel    = np.where( redshifts == z )[ 0 ]
+            dmflux = dmflux_anna( sigmav , 1. , mass , self[ 'emin' ].real() ,
+                mass * 0.95 , self._channels[ c ] , z ,
+                eblmod=self[ 'eblmodel' ].string() ,
+                has_EW=self[ 'ewcorrections' ].boolean() )
+            fluxes = dmflux.flux( jfactor=jfactors[ sel ] )
+
+            #   Units used by gammalib
+            for k , t in enumerate( sel ) :
+
+                self._spectra[ t ] = ( dmflux.energy * 1.e+3 , fluxes[ k ] * 1.e-3 )
+
+        theoflux = sum( self._gen_target_model( t ).spectral().eval( eref )
+                        for t in range( len( self._targets ) ) )
+
+        #   Targets with observations
+        tasks = [ t for t in range( len( self._targets ) ) if t in self._obs_targets ]
+        nproc = min( self._nthreads , len( tasks ) )
+        counts = {}
+
+        if nproc > 1 :
+
+            args        = [ ( self , '_target_signal' , ( t , layers ) ) for t in tasks ]
+            poolresults = mputils.process( nproc , mputils.mpfunc , args )
+
+            for k in range( len( tasks ) ) :
+
+                counts.update( poolresults[ k ][ 0 ] )
+                self._log_string( gammalib.EXPLICIT ,
+                    poolresults[ k ][ 1 ][ 'log' ] , False )
+
+        else :
+
+            for t in tasks :
+
+                counts.update( self._target_signal( ( t , layers ) ) )
+
+        #   Return
+        signal = np.concatenate( [ counts[ k ] for k in range( self.obs().size() ) ] )
+
+        #   Return
+        return signal , theoflux
+
+    def _lsv_grid( self ) :
+        """
+        Return grid of log10( sigmav ) for the likelihood surface
+        """
+
+        #   Return
+        return np.linspace( self[ 'lsvmin' ].real() , self[ 'lsvmax' ].real() ,
+            self[ 'lsvnumpoints' ].integer() )
+
+    def _logl_surface( self , signal , layers=None ) :
+        """
+        Compute profile log-likelihood over the grid of
+        log10( sigmav ). The flux scales linearly with sigmav,
+        so every point of the grid is the DM model with
+        normalization sigmav / sigmav_ref
+
+        Parameters
+        ----------
+        signal : Predicted counts of the DM model for sigmav_ref
+        layers : List with a slice of energy layers for every
+                 observation (see _energy_layers)
+
+        Return
+        ------
+        List with logL( sigmav ) - logL( 0 ), for every
+        point of the grid
+        """
+
+        norms  = np.power( 10. , self._lsv_grid() - self[ 'logsigmav' ].real() )
+        norms  = np.concatenate( ( [ 0.0 ] , norms ) )
+        sel    = self._stacked_cubes( 'weights' , layers ) > 0
+        fitbkg = not self[ 'fix_bkg' ].boolean()
+
+        logl , _ = likeprofile.profile_logl(
+            self._stacked_cubes( 'counts' , layers )[ sel ] , signal[ sel ] ,
+            self._stacked_cubes( 'background' , layers )[ sel ] , norms , fit_bkg=fitbkg )
+
+        #   Return
+        return list( logl[ 1 : ] - logl[ 0 ] )
+
+    def _fast_fit( self , result , signal , eref , theoflux , layers=None ) :
+        """
+        Fit the normalization of the DM model profiling the
+        Poisson likelihood of the binned observations with
+        numpy (see tools/likeprofile.py). The shape of the
+        background is fixed, only its normalization is fitted
+        if fix_bkg is False
+
+        Parameters
+        ----------
+        result   : Dictionary with results of the mass point
+        signal   : Predicted counts of the DM model
+                   for Normalization = 1
+        eref     : Reference energy
+        theoflux : Differential flux at eref for Normalization = 1
+        layers   : List with a slice of energy layers for every
+                   observation (see _energy_layers)
+        """
+
+        self._log_header3( gammalib.EXPLICIT , 'Profiling likelihood over normalization' )
+
+        profile = likeprofile.norm_profile( self._stacked_cubes( 'counts' , layers ) ,
+            signal , self._stacked_cubes( 'background' , layers ) ,
+            weights=self._stacked_cubes( 'weights' , layers ) ,
+            fit_bkg=not self[ 'fix_bkg' ].boolean() )
+
+        result[ 'fit_iter' ] = profile[ 'niter' ]
+        result[ 'fit_eval' ] = profile[ 'nfev' ]
+        result[ 'ul_steps' ] = profile[ 'nsteps' ]
+
+        timing.merge( result[ 'timing' ] , profile[ 'timing' ] )
+
+        self._log_value( gammalib.NORMAL , 'Fit iterations' , profile[ 'niter' ] )
+        self._log_value( gammalib.EXPLICIT , 'UL search steps' , profile[ 'nsteps' ] )
+        self._log_value( gammalib.EXPLICIT , 'Normalization' , profile[ 'norm' ] )
+        self._log_value( gammalib.EXPLICIT , 'Background scale' , profile[ 'bkg' ] )
+
+        eref2 = eref.MeV() * eref.MeV()
+
+        if self[ 'calc_ts' ].boolean() :
+
+            result[ 'TS' ] = profile[ 'ts' ]
+
+        if self[ 'calc_ulim' ].boolean() and profile[ 'ul' ] > 0.0 :
+
+            result[ 'ulimit' ]    = profile[ 'ul' ] * theoflux * eref2 * gammalib.MeV2erg
+            result[ 'sc_factor' ] = profile[ 'ul' ]
+            result[ 'sigma_lim' ] = profile[ 'ul' ] * 10**( self[ 'logsigmav' ].real() )
+
+        #   For the Asimov dataset, the upper limit is the median
+        #   expected limit, and the bands follow from asymptotic
+        #   formulae
+        if self._asimov :
+
+            bands  = likeprofile.asimov_bands( profile[ 'ul' ] )
+            sigmav = 10**( self[ 'logsigmav' ].real() )
+            keys   = ( 'median' , 'p1s' , 'm1s' , 'p2s' , 'm2s' )
+            result[ 'sigma_bands' ] = { key : bands[ key ] * sigmav for key in keys }
+
+            self._log_value( gammalib.NORMAL , 'Expected UL on sigmav' ,
+                '{0:e} [{1:e}, {2:e}] (68%) [{3:e}, {4:e}] (95%)'.format(
+                result[ 'sigma_bands' ][ 'median' ] , result[ 'sigma_bands' ][ 'm1s' ] ,
+                result[ 'sigma_bands' ][ 'p1s' ] , result[ 'sigma_bands' ][ 'm2s' ] ,
+                result[ 'sigma_bands' ][ 'p2s' ] ) )
+
+        #   Convert to nuFnu
+        result[ 'flux' ]     = profile[ 'norm' ] * theoflux * eref2 * gammalib.MeV2erg
+        result[ 'flux_err' ] = profile[ 'norm_err' ] * theoflux * eref2 * gammalib.MeV2erg
+
+        #   Logging
+        self._log_result( result )
+
+        #   Return
+        return
+
+    def _fit_mass_points( self , tasks=None ) :
+        """
+        Fit for GVector masses
+
+        Parameters
+        ----------
+        tasks: List of pairs ( index of channel , index of mass ).
+               If None, all channels and mass points of the shard
+
+        Return
+        ------
+        results: dictionary with result for every mass point
+        """
+
+        self._log_header1( gammalib.TERSE , 'Fitting models for different masses' )
+        self._log_string( gammalib.TERSE, str( self._masses ) )
+
+        if tasks is None :
+
+            #   Mass points of this shard
+            selected = self._shard_indices()
+
+            if self[ 'nshards' ].integer() > 1 :
+
+                self._log_value( gammalib.TERSE , 'Shard' , '{0} of {1}'.format(
+                    self[ 'shard' ].integer() , self[ 'nshards' ].integer() ) )
+                self._log_value( gammalib.TERSE , 'Mass points in shard' ,
+                    len( selected ) )
+
+            #   Every task is a pair ( index of channel , index of mass )
+            tasks = [ ( c , i ) for c in range( len( self._channels ) ) for i in selected ]
+
+        #   Channels
+        self._log_value( gammalib.TERSE , 'Channels' , ', '.join( self._channels ) )
+
+        #   Results of mass points already in the checkpoint
+        done = {}
+
+        if self._checkpoint is not None :
+
+            saved = self._checkpoint.load()
+
+            for c , i in tasks :
+
+                key = mass_key( self._masses[ i ] , self._channels[ c ] )
+
+                if key in saved :
+
+                    done[ ( c , i ) ] = saved[ key ]
+
+            self._log_value( gammalib.NORMAL , 'Checkpoint file' ,
+                self._checkpoint.filename )
+            self._log_value( gammalib.TERSE , 'Mass points from checkpoint' ,
+                len( done ) )
+
+        # Initialise results
+        fitted  = []
+        pending = [ task for task in tasks if task not in done ]
+        nproc   = min( self._nthreads , len( pending ) )
+
+        #   In the joint analysis of several targets, the
+        #   targets of every mass point are computed in parallel
+        if len( self._targets ) > 0 :
+
+            nproc = 1
+
+        #   Split mass points in chunks of consecutive masses
+        #   of the same channel. With warm starts, every chunk is
+        #   fitted in order, so each mass is initialised from its
+        #   neighbour
+        if nproc <= 1 :
+
+            self._chunks = [ pending ]
+
+        elif self[ 'warmstart' ].boolean() :
+
+            nblocks      = int( np.ceil( nproc / len( self._channels ) ) )
+            self._chunks = []
+
+            for c in range( len( self._channels ) ) :
+
+                indices = [ i for ( ch , i ) in pending if ch == c ]
+
+                nsplit = min( nblocks , max( len( indices ) , 1 ) )
+
+                for chunk in np.array_split( indices , nsplit ) :
+
+                    if len( chunk ) > 0 :
+
+                        self._chunks.append( [ ( c , int( i ) ) for i in chunk ] )
+
+        else :
+
+            self._chunks = [ [ task ] for task in pending ]
+
+        #   Fit mass points in parallel processes.
+        #   Every worker gets a copy of the script (see __getstate__)
+        #   and its log is buffered, then logs are merged in mass order
+        if nproc > 1 :
+
+            args        = [ ( self , '_fit_mass_chunk' , k )
+                            for k in range( len( self._chunks ) ) ]
+            poolresults = mputils.process( nproc , mputils.mpfunc , args )
+
+            # Construct results
+            for k in range( len( self._chunks ) ) :
+
+                fitted.extend( poolresults[ k ][ 0 ] )
+                self._log_string( gammalib.TERSE ,
+                    poolresults[ k ][ 1 ][ 'log' ] , False )
+
+        # Otherwise, loop over mass points
+        elif len( pending ) > 0 :
+
+            fitted = self._fit_mass_chunk( 0 )
+
+        #   Summary of optimizer iterations
+        self._log_value( gammalib.TERSE , 'Total optimizer iterations' ,
+            sum( result[ 'fit_iter' ] for result in fitted ) )
+
+        #   Results in channel and mass order
+        done.update( zip( [ task for chunk in self._chunks for task in chunk ] , fitted ) )
+        results = [ done[ task ] for task in tasks ]
+
+        # Return results
+        return results
+
+    def _add_masses( self , masses ) :
+        """
+        Append mass points to the GVector of masses
+
+        Parameters
+        ----------
+        masses: Masses (in GeV)
+
+        Return
+        ------
+        List with indices of the masses
+        """
+
+        current = [ self._masses[ i ] for i in range( self._masses.size() ) ]
+        indices = []
+
+        for mass in masses :
+
+            #   Mass points already in the grid are not added again
+            for i , value in enumerate( current ) :
+
+                if abs( value - mass ) <= 1.e-10 * mass :
+
+                    indices.append( i )
+                    break
+
+            else :
+
+                indices.append( len( current ) )
+                current.append( mass )
+
+        self._masses = gammalib.GVector( len( current ) )
+
+        for i , mass in enumerate( current ) :
+
+            self._masses[ i ] = mass
+
+        #   Return
+        return indices
+
+    def _fit_adaptive( self ) :
+        """
+        Fit mass points refining the grid of masses. The scan
+        starts with the grid of mnumpoints masses, and new
+        masses are inserted (independently for every channel)
+        where the curve log10( sigma_lim ) vs log10( mass ) bends
+        most or where TS changes fastest, until the tolerances
+        are met or a channel has adapt_maxpoints masses
+
+        Return
+        ------
+        results: list with result for every mass point, sorted
+                 by channel and mass
+        """
+
+        results   = self._fit_mass_points()
+        iteration = 0
+
+        while True :
+
+            iteration += 1
+            tasks      = []
+            newmasses  = []
+
+            for c , channel in enumerate( self._channels ) :
+
+                chresults = sorted( [ result for result in results
+                    if result[ 'channel' ] == channel ] ,
+                    key=lambda result : result[ 'mass' ] )
+
+                #   Masses in GeV
+                logm   = np.log10( [ 1.e+3 * result[ 'mass' ] for result in chresults ] )
+                sigmav = np.array( [ result[ 'sigma_lim' ] for result in chresults ] )
+                logsv  = np.full( sigmav.size , np.nan )
+                ok     = sigmav > 0.0
+                logsv[ ok ] = np.log10( sigmav[ ok ] )
+                ts     = [ result[ 'TS' ] for result in chresults ]
+                budget = self[ 'adapt_maxpoints' ].integer() - len( chresults )
+
+                new = massgrid.refine( logm , logsv , ts , self[ 'adapt_tol' ].real() ,
+                    self[ 'adapt_tstol' ].real() , budget )
+
+                if len( new ) == 0 :
+
+                    continue
+
+                newmasses.append( ( c , np.power( 10. , new ) ) )
+
+            if len( newmasses ) == 0 :
+
+                break
+
+            for c , masses in newmasses :
+
+                indices = self._add_masses( masses )
+                tasks.extend( [ ( c , i ) for i in indices ] )
+
+            #   Only masses not fitted before
+            fitted = set( ( result[ 'channel' ] , round( result[ 'mass' ] , 12 ) )
+                          for result in results )
+            tasks  = [ ( c , i ) for c , i in tasks
+                       if ( self._channels[ c ] , round( 1.e-3 * self._masses[ i ] , 12 ) )
+                       not in fitted ]
+
+            if len( tasks ) == 0 :
+
+                break
+
+            self._log_header1( gammalib.TERSE ,
+                'Refining mass grid (iteration {0})'.format( iteration ) )
+            self._log_value( gammalib.TERSE , 'New mass points' , len( tasks ) )
+
+            results.extend( self._fit_mass_points( tasks ) )
+
+        #   Sort results by channel and mass
+        order   = { channel : c for c , channel in enumerate( self._channels ) }
+        results = sorted( results , key=lambda result :
+            ( order[ result[ 'channel' ] ] , result[ 'mass' ] ) )
+
+        self._log_value( gammalib.TERSE , 'Mass points after refinement' ,
+            len( results ) )
+
+        #   Return
+        return results
+
+    def _fit_toys( self , results ) :
+        """
+        Simulate background-only datasets from the background
+        cubes and fit the DM normalization of every mass point
+        (see tools/toymc.py). Toys are distributed over nthreads
+        processes. Every toy has its own random stream derived
+        from the seed parameter, and the same toys are used for
+        all mass points (with eprune, toys of every mass point
+        are simulated in the energy layers of the mass point)
+
+        Parameters
+        ----------
+        results: List with results of mass points. The upper
+                 limits of the toys and their median and
+                 containment bands are added to every result
+        """
+
+        ntoys   = self[ 'ntoys' ].integer()
+        seed    = self[ 'seed' ].integer()
+        sigmav  = 10**( self[ 'logsigmav' ].real() )
+
+        self._log_header1( gammalib.TERSE , 'Toy Monte Carlo' )
+        self._log_value( gammalib.TERSE , 'Number of toys' , ntoys )
+        self._log_value( gammalib.TERSE , 'Seed' , seed )
+
+        for result in results :
+
+            c       = self._channels.index( result[ 'channel' ] )
+            i       = result[ 'index' ]
+            start   = timing.clock()
+
+            #   Mass points skipped by eprune are flagged as failed
+            if self._empty_range( i ) :
+
+                result[ 'toys' ]      = { 'runid' : np.arange( 1 , ntoys + 1 ) ,
+                                          'ts'    : np.zeros( ntoys ) ,
+                                          'ul'    : np.full( ntoys , -1.0 ) ,
+                                          'norm'  : np.zeros( ntoys ) }
+                result[ 'toy_bands' ] = toymc.containment_bands( [] )
+
+                continue
+
+            layers  = self._energy_layers( i )
+            weights = self._stacked_cubes( 'weights' , layers )
+            bkg     = self._stacked_cubes( 'background' , layers )
+
+            #   Predicted counts of the DM model
+            if len( self._targets ) > 0 :
+
+                eref       = gammalib.GEnergy( result[ 'energy' ] , 'TeV' )
+                signal , _ = self._targets_signal( c , i , eref , layers )
+
+            else :
+
+                energies , fluxes = self._gen_dmflux_anna( i , result[ 'channel' ] )
+                signal = self._signal_counts( self._gen_model( energies , fluxes ,
+                    tscalc=False ) , layers )
+
+            toys = toymc.run_toys( bkg , signal , ntoys , seed ,
+                nproc=self._nthreads , weights=weights ,
+                fit_bkg=not self[ 'fix_bkg' ].boolean() )
+
+            bands = toymc.containment_bands( toys[ 'ul' ] )
+
+            result[ 'toys' ]      = toys
+            result[ 'toy_bands' ] = { key : value * sigmav
+                                      for key , value in bands.items() }
+
+            timing.add_time( result.setdefault( 'timing' , {} ) , 'toys' , start )
+
+            self._log_value( gammalib.NORMAL ,
+                'Mass {0:.3f} TeV ({1})'.format( result[ 'mass' ] , result[ 'channel' ] ) ,
+                '{0:e} [{1:e}, {2:e}] (68%) [{3:e}, {4:e}] (95%)'.format(
+                result[ 'toy_bands' ][ 'median' ] , result[ 'toy_bands' ][ 'm1s' ] ,
+                result[ 'toy_bands' ][ 'p1s' ] , result[ 'toy_bands' ][ 'm2s' ] ,
+                result[ 'toy_bands' ][ 'p2s' ] ) )
+
+        #   Return
+        return
+
+    def _fit_mass_chunk( self , k ) :
+        """
+        Fit mass points in chunk k, in order
+
+        Return
+        ------
+        results: list with result for every mass point in the chunk
+        """
+
+        # Initialise results
+        results = []
+
+        for c , i in self._chunks[ k ] :
+
+            # Fit mass point
+            result = self._fit_mass_point( c , i )
+
+            # Save result as soon as it is available
+            if self._checkpoint is not None :
+
+                self._checkpoint.append( mass_key( self._masses[ i ] ,
+                    self._channels[ c ] ) , result )
+
+            # Append results
+            results.append( result )
+
+        # Return results
+        return results
+
+
+    def _create_fits( self , results ) :
+        """
+        Create fits file. There is one DMATTER extension per
+        channel. For several channels, the name of the channel
+        is appended to the name of the extension (DMATTER_<channel>)
+
+        Parameters
+        ----------
+        result: Dictionary with results obtained from fit
+        """
+
+        self._fits = gammalib.GFits()
+
+        for channel in self._channels :
+
+            chresults = [ result for result in results if result[ 'channel' ] == channel ]
+            suffix    = '' if len( self._channels ) == 1 else '_' + channel
+
+            self._fits.append( self._create_table( chresults , channel ,
+                'DMATTER' + suffix ) )
+
+            #   Timing and fit diagnostics
+            self._fits.append( self._timing_table( chresults ,
+                'DMTIMING' + suffix ) )
+
+            #   Likelihood surface
+            if self._scan2d :
+
+                self._fits.append( self._surface_image( chresults ,
+                    'LOGLSURFACE' + suffix ) )
+
+            #   Toys
+            if self[ 'ntoys' ].integer() > 0 :
+
+                self._fits.append( self._toys_table( chresults ,
+                    'DMTOYS' + suffix ) )
+
+        #   Targets of the joint analysis
+        if len( self._targets ) > 0 :
+
+            self._fits.append( self._targets_table() )
+
+        #   Return
+        return
+
+    def _create_table( self , results , channel , extname ) :
+        """
+        Create table with results of a channel
+
+        Parameters
+        ----------
+        results : List with results of mass points
+        channel : Annihilation channel
+        extname : Name of extension
+
+        Return
+        ------
+        GFitsBinTable
         """
 
         #   Create columns (><'! Now, added for n mass points')
-        nrows = self._masses.size()
+        nrows = len( results )
 
         energy       = gammalib.GFitsTableDoubleCol( 'RefEnergy' , nrows )
         mass         = gammalib.GFitsTableDoubleCol( 'Mass' , nrows )
@@ -675,12 +2192,35 @@ class csdmatter( ctools.csobservation ) :
 
         #   Initialise FITS Table with extension "DMATTER"
         table = gammalib.GFitsBinTable( nrows )
-        table.extname( 'DMATTER' )
+        table.extname( extname )
 
         #   Add Header for compatibility with gammalib.GMWLSpectrum
         table.card( 'INSTRUME' , 'CTA' , 'Name of Instrument' )
         table.card( 'TELESCOP' , 'CTA' , 'Name of Telescope' )
 
+        #   Reference parameters of the scan, used to check
+        #   consistency when merging tables from several shards
+        table.card( 'PROCESS' , self[ 'process' ].string() , 'DM interaction' )
+        table.card( 'CHANNEL' , channel , 'Annihilation channel' )
+        table.card( 'EWCORR' , 'yes' if self[ 'ewcorrections' ].boolean() else 'no' ,
+            'Electro-weak corrections' )
+        table.card( 'EBLMODEL' , self[ 'eblmodel' ].string() , 'EBL model' )
+        table.card( 'REDSHIFT' , self[ 'redshift' ].real() , 'Redshift' )
+        table.card( 'LOGJ' , self[ 'logastfactor' ].real() ,
+            'log10 of astrophysical factor [GeV2/cm5]' )
+        table.card( 'MMIN' , self[ 'mmin' ].real() , '[GeV] Minimum DM mass of the scan' )
+        table.card( 'MMAX' , self[ 'mmax' ].real() , '[GeV] Maximum DM mass of the scan' )
+        table.card( 'MNUMPTS' , self[ 'mnumpoints' ].integer() ,
+            'Number of masses of the scan' )
+        table.card( 'SHARD' , self[ 'shard' ].integer() , 'Shard of mass points' )
+        table.card( 'NSHARDS' , self[ 'nshards' ].integer() , 'Number of shards' )
+        table.card( 'NTARGETS' , len( self._targets ) ,
+            'Number of targets of joint analysis (0 for one source)' )
+        table.card( 'ASIMOV' , 'yes' if self._asimov else 'no' ,
+            'Expected limits from Asimov dataset' )
+        table.card( 'EPRUNE' , 'yes' if self._eprune else 'no' ,
+            'Energy range restricted to [emin, 0.95 * mass]' )
+
         #   Append filled columns to fits table
         table.append( energy )
         table.append( mass )
@@ -692,13 +2232,308 @@ class csdmatter( ctools.csobservation ) :
         table.append( sigma_ref )
         table.append( sc_factor )
 
-        #   Create the FITS file now
-        self._fits = gammalib.GFits()
-        self._fits.append( table )
+        #   Expected limits (toys)
+        if self[ 'ntoys' ].integer() > 0 :
+
+            for key , colname in ( ( 'median' , 'ToyULMedian' ) ,
+                                   ( 'p1s' , 'ToyULP1S' ) ,
+                                   ( 'm1s' , 'ToyULM1S' ) ,
+                                   ( 'p2s' , 'ToyULP2S' ) ,
+                                   ( 'm2s' , 'ToyULM2S' ) ) :
+
+                column = gammalib.GFitsTableDoubleCol( colname , nrows )
+                column.unit( 'cm3/s' )
+
+                for i , result in enumerate( results ) :
+
+                    column[ i ] = result[ 'toy_bands' ][ key ]
+
+                table.append( column )
+
+        #   Expected limits (Asimov mode)
+        if self._asimov :
+
+            for key , colname in ( ( 'median' , 'ULCrossSectionMedian' ) ,
+                                   ( 'p1s' , 'ULCrossSectionP1S' ) ,
+                                   ( 'm1s' , 'ULCrossSectionM1S' ) ,
+                                   ( 'p2s' , 'ULCrossSectionP2S' ) ,
+                                   ( 'm2s' , 'ULCrossSectionM2S' ) ) :
+
+                column = gammalib.GFitsTableDoubleCol( colname , nrows )
+                column.unit( 'cm3/s' )
+
+                for i , result in enumerate( results ) :
+
+                    column[ i ] = result[ 'sigma_bands' ][ key ]
+
+                table.append( column )
+
+        #   Return
+        return table
+
+    def _toys_table( self , results , extname='DMTOYS' ) :
+        """
+        Create table with the results of the toys. There is
+        one row per toy and mass point
+
+        Parameters
+        ----------
+        results : List with results of mass points
+        extname : Name of extension
+
+        Return
+        ------
+        GFitsBinTable
+        """
+
+        ntoys  = self[ 'ntoys' ].integer()
+        nrows  = ntoys * len( results )
+        sigmav = 10**( self[ 'logsigmav' ].real() )
+
+        runid     = gammalib.GFitsTableIntCol( 'RunID' , nrows )
+        mass      = gammalib.GFitsTableDoubleCol( 'Mass' , nrows )
+        ts        = gammalib.GFitsTableDoubleCol( 'TS' , nrows )
+        ulflux    = gammalib.GFitsTableDoubleCol( 'ULFlux' , nrows )
+        sc_factor = gammalib.GFitsTableDoubleCol( 'ScaleFactor' , nrows )
+        sigma_lim = gammalib.GFitsTableDoubleCol( 'ULCrossSection' , nrows )
+
+        mass.unit( 'TeV' )
+        ulflux.unit( 'erg/cm2/s' )
+        sigma_lim.unit( 'cm3/s' )
+
+        row = 0
+
+        for result in results :
+
+            toys = result[ 'toys' ]
+
+            for k in range( ntoys ) :
+
+                runid[ row ]     = int( toys[ 'runid' ][ k ] )
+                mass[ row ]      = result[ 'mass' ]
+                ts[ row ]        = toys[ 'ts' ][ k ]
+                ulflux[ row ]    = toys[ 'ul' ][ k ] * result[ 'ref_flux' ]
+                sc_factor[ row ] = toys[ 'ul' ][ k ]
+                sigma_lim[ row ] = toys[ 'ul' ][ k ] * sigmav
+                row             += 1
+
+        table = gammalib.GFitsBinTable( nrows )
+        table.extname( extname )
+        table.card( 'NTOYS' , ntoys , 'Number of toys per mass point' )
+        table.card( 'SEED' , self[ 'seed' ].integer() , 'Master seed of the toys' )
+        table.append( runid )
+        table.append( mass )
+        table.append( ts )
+        table.append( ulflux )
+        table.append( sc_factor )
+        table.append( sigma_lim )
+
+        #   Return
+        return table
+
+    def _timing_table( self , results , extname='DMTIMING' ) :
+        """
+        Create table with wall and CPU time of every stage of
+        the fit of the mass points (see tools/timing.py), and
+        the number of iterations and function evaluations of
+        the fit and of steps of the upper limit search (-1 if
+        not available)
+
+        Parameters
+        ----------
+        results : List with results of mass points
+        extname : Name of extension
+
+        Return
+        ------
+        GFitsBinTable
+        """
+
+        nrows = len( results )
+        mass  = gammalib.GFitsTableDoubleCol( 'Mass' , nrows )
+        mass.unit( 'TeV' )
+
+        #   Column names of stages
+        names  = { 'model'  : 'Model' ,
+                   'signal' : 'Signal' ,
+                   'like'   : 'Like' ,
+                   'ulimit' : 'ULimit' ,
+                   'toys'   : 'Toys' ,
+                   'total'  : 'Total' }
+        times  = {}
+
+        for stage in timing.STAGES + ( 'total' , ) :
+
+            for kind , suffix in ( ( 'wall' , 'Wall' ) , ( 'cpu' , 'CPU' ) ) :
+
+                column = gammalib.GFitsTableDoubleCol( names[ stage ] + suffix , nrows )
+                column.unit( 's' )
+                times[ ( stage , kind ) ] = column
+
+        fit_iter = gammalib.GFitsTableIntCol( 'FitIterations' , nrows )
+        fit_eval = gammalib.GFitsTableIntCol( 'FuncEvals' , nrows )
+        ul_steps = gammalib.GFitsTableIntCol( 'ULSteps' , nrows )
+
+        for row , result in enumerate( results ) :
+
+            stages = result.get( 'timing' , {} )
+
+            for ( stage , kind ) , column in times.items() :
+
+                if stage == 'total' :
+
+                    column[ row ] = timing.total_time( stages , kind )
+
+                else :
+
+                    column[ row ] = timing.stage_time( stages , stage , kind )
+
+            mass[ row ]     = result[ 'mass' ]
+            fit_iter[ row ] = int( result[ 'fit_iter' ] )
+            fit_eval[ row ] = int( result.get( 'fit_eval' , -1 ) )
+            ul_steps[ row ] = int( result.get( 'ul_steps' , -1 ) )
+
+        table = gammalib.GFitsBinTable( nrows )
+        table.extname( extname )
+        table.append( mass )
+
+        for stage in timing.STAGES + ( 'total' , ) :
+
+            table.append( times[ ( stage , 'wall' ) ] )
+            table.append( times[ ( stage , 'cpu' ) ] )
+
+        table.append( fit_iter )
+        table.append( fit_eval )
+        table.append( ul_steps )
+
+        #   Return
+        return table
+
+    def _log_timing( self , results ) :
+        """
+        Log total wall and CPU time of every stage, and the
+        slowest mass point of every stage
+
+        Parameters
+        ----------
+        results : List with results of mass points
+        """
+
+        self._log_header1( gammalib.TERSE , 'Timing summary' )
+
+        stages = timing.summary( [ result.get( 'timing' , {} ) for result in results ] )
+
+        for stage , value in stages.items() :
+
+            slowest = results[ value[ 'argmax' ] ]
+
+            self._log_value( gammalib.TERSE , 'Stage ' + stage ,
+                '{0:.3f} s (wall) {1:.3f} s (CPU)'.format( value[ 'wall' ] ,
+                value[ 'cpu' ] ) )
+            self._log_value( gammalib.NORMAL , 'Slowest mass point (' + stage + ')' ,
+                '{0:.3f} TeV ({1}) {2:.3f} s'.format( slowest[ 'mass' ] ,
+                slowest[ 'channel' ] , value[ 'max' ] ) )
+
+        self._log_value( gammalib.TERSE , 'Total optimizer iterations' ,
+            sum( result[ 'fit_iter' ] for result in results ) )
+
+        evals = [ result.get( 'fit_eval' , -1 ) for result in results ]
+
+        if all( value >= 0 for value in evals ) :
+
+            self._log_value( gammalib.TERSE , 'Total function evaluations' , sum( evals ) )
 
         #   Return
         return
 
+    def _targets_table( self ) :
+        """
+        Create table with the targets of the joint analysis
+
+        Return
+        ------
+        GFitsBinTable with extension "TARGETS"
+        """
+
+        nrows = len( self._targets )
+        width = max( len( target[ 'name' ] ) for target in self._targets )
+
+        name     = gammalib.GFitsTableStringCol( 'Name' , nrows , width )
+        ra       = gammalib.GFitsTableDoubleCol( 'RA' , nrows )
+        dec      = gammalib.GFitsTableDoubleCol( 'DEC' , nrows )
+        logj     = gammalib.GFitsTableDoubleCol( 'LogJ' , nrows )
+        redshift = gammalib.GFitsTableDoubleCol( 'Redshift' , nrows )
+        nobs     = gammalib.GFitsTableIntCol( 'NObs' , nrows )
+
+        ra.unit( 'deg' )
+        dec.unit( 'deg' )
+        logj.unit( 'GeV2/cm5' )
+
+        for t , target in enumerate( self._targets ) :
+
+            name[ t ]     = target[ 'name' ]
+            ra[ t ]       = target[ 'ra' ]
+            dec[ t ]      = target[ 'dec' ]
+            logj[ t ]     = target[ 'logj' ]
+            redshift[ t ] = target[ 'z' ]
+            nobs[ t ]     = self._obs_targets.count( t )
+
+        table = gammalib.GFitsBinTable( nrows )
+        table.extname( 'TARGETS' )
+        table.append( name )
+        table.append( ra )
+        table.append( dec )
+        table.append( logj )
+        table.append( redshift )
+        table.append( nobs )
+
+        #   Return
+        return table
+
+    def _surface_image( self , results , extname='LOGLSURFACE' ) :
+        """
+        Create image with the likelihood surface. The first axis
+        follows the rows (masses) of the DMATTER table, and the
+        second axis is log10( sigmav )
+
+        Parameters
+        ----------
+        results: List with results of mass points
+        extname: Name of extension
+
+        Return
+        ------
+        GFitsImageDouble
+        """
+
+        lsv   = self._lsv_grid()
+        image = gammalib.GFitsImageDouble( len( results ) , lsv.size )
+        image.extname( extname )
+
+        for ix , result in enumerate( results ) :
+
+            for iy , value in enumerate( result[ 'loglsurface' ] ) :
+
+                image[ ix , iy ] = value
+
+        #   Axes
+        image.card( 'BUNIT' , 'logL - logL0' ,
+            'Profile log-likelihood with respect to background only' )
+        image.card( 'CTYPE1' , 'MASSROW' , 'Row of DMATTER table' )
+        image.card( 'CRPIX1' , 1.0 , 'Reference pixel' )
+        image.card( 'CRVAL1' , 0.0 , 'Row at reference pixel' )
+        image.card( 'CDELT1' , 1.0 , 'Increment' )
+        image.card( 'CTYPE2' , 'LOGSIGV' , 'log10 of sigmav [cm3/s]' )
+        image.card( 'CRPIX2' , 1.0 , 'Reference pixel' )
+        image.card( 'CRVAL2' , lsv[ 0 ] , 'log10( sigmav ) at reference pixel' )
+        image.card( 'CDELT2' , lsv[ 1 ] - lsv[ 0 ] if lsv.size > 1 else 0.0 ,
+            'Increment of log10( sigmav )' )
+        image.card( 'LOGSVREF' , self[ 'logsigmav' ].real() ,
+            'log10 of reference sigmav [cm3/s]' )
+
+        #   Return
+        return image
+
     def run( self ) :
         """
         Run the script
@@ -710,32 +2545,52 @@ class csdmatter( ctools.csobservation ) :
 
         #   Getting parameters
         self._get_parameters()
-        srcname = self[ 'srcname' ].string()
 
         #   Write input observation container into logger
         self._log_observations( gammalib.NORMAL , self.obs() , 'Input observation' )
 
-        # for i in range( self[ 'mnumpoints' ].integer() ) :
-
-        #     self._gen_dmfile_anna( i )
-        #     dmmodel = self._gen_model( i )
-        #     print( dmmodel.spectral().filename() )
-
         #   Adjust model parameters dependent on input user parameters
         # self._adjust_models()
 
+        #   Fit background-only model once. For the Asimov
+        #   dataset, the background is the IRF background model.
+        #   With eprune, ctlike fits the null hypothesis in the
+        #   energy range of every mass point, so the full-range
+        #   null is not needed
+        if self._eprune and not self._fastfit :
+
+            self._log_value( gammalib.TERSE , 'TS' ,
+                'Null refitted in the energy range of every mass point' )
+
+        elif self[ 'cache_null' ].boolean() and not self._asimov :
+
+            self._fit_null()
+
+        #   Counts and background cubes for the fast fit,
+        #   the likelihood surface and the toys
+        if self._fastfit or self._scan2d or self[ 'ntoys' ].integer() > 0 :
+
+            self._prepare_cubes()
+
         #   Fit model
-        results = self._fit_mass_points()
+        if self[ 'adaptive' ].boolean() :
 
-        #   Create FITS file
-        self._create_fits( results )
+            results = self._fit_adaptive()
+
+        else :
 
-        #   Erasing file
-        for index in range( self._masses.size() ) :
+            results = self._fit_mass_points()
 
+        #   Expected limits from toys
+        if self[ 'ntoys' ].integer() > 0 :
 
-            fname = '{0}_dmflux_mpoint{1}.txt'.format( srcname , index )
-            os.remove( fname )
+            self._fit_toys( results )
+
+        #   Summary of wall and CPU time of every stage
+        self._log_timing( results )
+
+        #   Create FITS file
+        self._create_fits( results )
 
         #   Publishing...?
         if self[ 'publish' ].boolean() :
@@ -1,3 +1,3 @@
 #   Sergio, 2020
 
-__all__ = [ 'dmspectra' , 'dmflux' ]
+__all__ = [ 'dmspectra' , 'dmflux' , 'dmtables' , 'dmcache' , 'dminterp' , 'dmebl' ]
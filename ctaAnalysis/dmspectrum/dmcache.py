@@ -0,0 +1,171 @@
+#=======================================#
+#   Process-wide cache of interpolators #
+#   used to compute DM spectra          #
+#=======================================#
+import numpy as np
+
+from collections import OrderedDict
+import threading
+
+def _nbytes( obj ) :
+    """
+    Estimate the memory (in bytes) held by an object
+    through its numpy arrays
+    """
+
+    if isinstance( obj , np.ndarray ) :
+
+        return obj.nbytes
+
+    if hasattr( obj , 'nbytes' ) :
+
+        return int( obj.nbytes )
+
+    if isinstance( obj , ( tuple , list ) ) :
+
+        return sum( _nbytes( item ) for item in obj )
+
+    if hasattr( obj , '__dict__' ) :
+
+        return sum( _nbytes( item ) for item in vars( obj ).values()
+            if isinstance( item , ( np.ndarray , tuple , list ) ) )
+
+    #   Return
+    return 0
+
+class InterpolatorCache() :
+    """
+    Bounded (LRU) cache of ready-to-evaluate interpolators.
+    Objects are created by a builder function the first
+    time a key is requested.
+    """
+
+    def __init__( self , maxsize=16 ) :
+        """
+        Initialize cache
+
+        Parameters
+        ----------
+            maxsize : Maximum number of objects kept in the cache
+        """
+
+        if maxsize < 1 :
+
+            raise ValueError( ( '\nSize of cache must be at least 1. ' +
+                'Got {0}'.format( maxsize ) ) )
+
+        self._maxsize = maxsize
+        self._items   = OrderedDict()
+        self._sizes   = {}
+        self._lock    = threading.Lock()
+        self._hits    = 0
+        self._misses  = 0
+
+        #   Return
+        return
+
+    @property
+    def maxsize( self ) :
+        """
+        Return the maximum number of objects in the cache
+        """
+
+        #   Return
+        return self._maxsize
+
+    @property
+    def nbytes( self ) :
+        """
+        Return the memory (in bytes) held by the cached objects
+        """
+
+        #   Return
+        return sum( self._sizes.values() )
+
+    def __len__( self ) :
+
+        return len( self._items )
+
+    def __contains__( self , key ) :
+
+        return key in self._items
+
+    def get( self , key , builder ) :
+        """
+        Return the object stored with key. If key is not in
+        the cache, the object is created calling builder( *key )
+
+        Parameters
+        ----------
+            key     : Tuple used as key
+            builder : Function to create the object
+
+        Return
+        ------
+            Cached object
+        """
+
+        with self._lock :
+
+            if key in self._items :
+
+                self._hits += 1
+                self._items.move_to_end( key )
+
+                return self._items[ key ]
+
+            self._misses += 1
+
+        #   Build outside the lock, building may take a while
+        obj = builder( *key )
+
+        with self._lock :
+
+            self._items[ key ] = obj
+            self._sizes[ key ] = _nbytes( obj )
+            self._items.move_to_end( key )
+
+            #   Remove least recently used objects
+            while len( self._items ) > self._maxsize :
+
+                oldkey , _ = self._items.popitem( last=False )
+                del self._sizes[ oldkey ]
+
+        #   Return
+        return obj
+
+    def stats( self ) :
+        """
+        Return dictionary with cache statistics:
+            hits, misses, size, maxsize and bytes
+        """
+
+        #   Return
+        return { 'hits'    : self._hits ,
+                 'misses'  : self._misses ,
+                 'size'    : len( self._items ) ,
+                 'maxsize' : self._maxsize ,
+                 'bytes'   : self.nbytes }
+
+    def clear( self ) :
+        """
+        Remove all objects from the cache and reset statistics
+        """
+
+        with self._lock :
+
+            self._items.clear()
+            self._sizes.clear()
+            self._hits   = 0
+            self._misses = 0
+
+        #   Return
+        return
+
+#   Cache of interpolators used by dmspectrum,
+#   keys are ( channel , has_EW )
+DMINTERP_CACHE = InterpolatorCache( maxsize=16 )
+
+#   Cache of cumulative integrals of the PPPC4DMID tables,
+#   keys are ( channel , has_EW )
+DMCUMUL_CACHE  = InterpolatorCache( maxsize=16 )
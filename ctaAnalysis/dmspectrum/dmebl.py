@@ -0,0 +1,62 @@
+#=======================================#
+#   EBL attenuation with cached         #
+#   ebl-table models                    #
+#=======================================#
+import numpy as np
+from ebltable.tau_from_model import OptDepth
+from ctaAnalysis.dmspectrum.dmcache import InterpolatorCache
+
+#   Below this redshift, attenuation is 1
+ZMIN_ATTEN = 1.e-3
+
+#   Cache of OptDepth instances, keys are ( eblmodel , )
+EBL_MODEL_CACHE = InterpolatorCache( maxsize=16 )
+
+def optdepth( eblmodel ) :
+    """
+    Return OptDepth instance from ebl-table project.
+    Model files are read only once per process.
+
+    Parameters
+    ----------
+        eblmodel : EBL Model
+    """
+
+    #   Return
+    return EBL_MODEL_CACHE.get( ( eblmodel , ) , OptDepth.readmodel )
+
+def attenuation( z , eblmodel , egev ) :
+    """
+    Compute EBL attenuation exp( -tau( z , E ) )
+
+    Parameters
+    ----------
+        z        : Redshift. Scalar or array
+        eblmodel : EBL Model
+        egev     : Energy (in GeV). Scalar or array
+
+    Return
+    ------
+        atten : Array with shape z.shape + egev.shape
+    """
+
+    z     = np.asarray( z , dtype=float )
+    egev  = np.asarray( egev , dtype=float )
+    zs    = np.atleast_1d( z ).ravel()
+    eflat = egev.ravel()
+
+    atten = np.ones( ( zs.size , eflat.size ) )
+
+    #   Redshifts below ZMIN_ATTEN are not attenuated
+    sel   = zs >= ZMIN_ATTEN
+
+    if sel.any() :
+
+        zsel = zs[ sel ]
+        tau  = optdepth( eblmodel ).opt_depth( zsel , eflat * 1.e-3 )
+        tau  = np.reshape( tau , ( zsel.size , eflat.size ) )
+
+        atten[ sel ] = np.exp( -1. * tau )
+
+    #   Return
+    return atten.reshape( z.shape + egev.shape )
@@ -21,7 +21,8 @@ class dmflux_anna( dmspectrum ) :
 
     #   Init
     def __init__( self , sigmav , jfactor , dm_mass , emin , emax , channel ,\
-        z , delta='Majorana' , npoints=100 , eblmod='franceschini2017' , has_EW=True ) :
+        z , delta='Majorana' , npoints=100 , eblmod='franceschini2017' , has_EW=True ,\
+        cache_spectrum=False ) :
         """
         Initialize the dmflux_anna class
 
@@ -41,6 +42,10 @@ class dmflux_anna( dmspectrum ) :
             eblmod  : EBL model used to compute attenuation
             has_EW  : Boolean to indicate if EW corrections
                       are taken into account or not
+            cache_spectrum : Boolean to keep the attenuated dN/dE
+                      between calls to flux(). The spectrum is
+                      recomputed only when mass, energies, channel,
+                      redshift, EBL model or EW corrections change
         """
 
         #   Additionally to check that emin and emax have valid values
@@ -77,6 +82,39 @@ class dmflux_anna( dmspectrum ) :
         self._emax    = e_max
         self._delta   = delta
 
+        #   Cached spectrum
+        self._cache_spectrum = cache_spectrum
+        self._spectrum_key   = None
+        self._spectrum       = None
+
+        #   Return
+        return
+
+    @property
+    def cache_spectrum( self ) :
+        """
+        Return if the attenuated dN/dE is kept between
+        calls to flux()
+        """
+
+        #   Return
+        return self._cache_spectrum
+
+    @cache_spectrum.setter
+    def cache_spectrum( self , cache_spectrum ) :
+        """
+        Set if the attenuated dN/dE is kept between
+        calls to flux()
+        """
+
+        self._cache_spectrum = cache_spectrum
+
+        #   Drop cached spectrum
+        if not cache_spectrum :
+
+            self._spectrum_key = None
+            self._spectrum     = None
+
         #   Return
         return
 
@@ -264,18 +302,233 @@ class dmflux_anna( dmspectrum ) :
 
         return ppfactor
 
-    def flux( self ) :
+    def _cached_spectra( self ) :
+        """
+        Return the attenuated dN/dE, computing it again only
+        if some parameter of the spectrum changed
+        """
+
+        key = ( self._mass , self._channel , self._z , self._eblmodel , self._ew )
+
+        if ( self._spectrum is None or key != self._spectrum_key[ 0 ] or
+            not np.array_equal( self._energy , self._spectrum_key[ 1 ] ) ) :
+
+            self._spectrum     = self.spectra()
+            self._spectrum_key = ( key , np.array( self._energy , copy=True ) )
+
+        #   Return
+        return self._spectrum
+
+    def flux( self , sigmav=None , jfactor=None ) :
         """
         Compute the DM flux
+
+        The flux is linear in sigmav and jfactor, so arrays
+        of values can be passed to compute a family of fluxes
+        with a single evaluation of the spectrum
+
+        Parameters
+        ----------
+            sigmav  : Annihilation cross-section (cm**3/s).
+                      Scalar or array. If None, use the value
+                      of the instance
+            jfactor : Astrophysical factor (GeV**2/cm**5).
+                      Scalar or array. If None, use the value
+                      of the instance
+
+        Return
+        ------
+            dphide : Array (n_energy) if sigmav and jfactor are
+                     scalars. Otherwise, array with shape
+                     broadcast( sigmav , jfactor ).shape + (n_energy,)
         """
 
+        if sigmav is None :
+
+            sigmav = self._sigmav
+
+        elif ( np.asarray( sigmav ) < 1.e-35 ).any() :
+
+            raise ValueError( ( '\nValue of annihilation cross-section ' +
+                ' must be greater than 1.e-35.\n' +
+                'This is just to avoid possible round errors' ) )
+
+        if jfactor is None :
+
+            jfactor = self._jfactor
+
         #   Get dnde
-        dnde     = self.spectra()
+        if self._cache_spectrum :
+
+            dnde = self._cached_spectra()
+
+        else :
+
+            dnde = self.spectra()
 
         #   Get ppfactor
-        ppfactor = self._ppfactor( self._sigmav , self._mass , self._delta )
+        ppfactor = self._ppfactor( np.asarray( sigmav ) , self._mass , self._delta )
+        norm     = ppfactor * np.asarray( jfactor )
 
         #   Get the flux
-        dphide   = ppfactor * dnde * self._jfactor
+        if np.ndim( norm ) == 0 :
+
+            dphide = norm * dnde
+
+        else :
+
+            dphide = norm[ ... , np.newaxis ] * dnde
 
         return dphide
+
+    def flux_grid( self , masses , energies=None , xmax=None ) :
+        """
+        Compute the DM flux for several masses in one
+        vectorized evaluation. See dmspectrum.spectra_grid
+
+        Parameters
+        ----------
+            masses   : Masses (in GeV) of dark matter particle
+            energies : Energies (in GeV). If None, use
+                       the energies of the instance
+            xmax     : If not None, energies above xmax * mass
+                       are masked for every mass
+                       (for example, xmax=0.95 as in csdmatter)
+
+        Return
+        ------
+            dphide : Array (n_mass, n_energy)
+        """
+
+        masses   = np.atleast_1d( np.asarray( masses , dtype=float ) )
+
+        #   Get dnde
+        dnde     = self.spectra_grid( masses , energies , xmax=xmax )
+
+        #   Get ppfactor for every mass
+        ppfactor = self._ppfactor( self._sigmav , masses , self._delta )
+
+        #   Get the flux
+        dphide   = ppfactor[ : , np.newaxis ] * dnde * self._jfactor
+
+        return dphide
+
+    def flux_sources( self , masses , jfactors , redshifts , energies=None , xmax=None ) :
+        """
+        Compute the DM flux for a list of sources in one call.
+        Cross-section, channel, EBL model and kind of fermion
+        are taken from the instance. See dmspectrum.spectra_sources
+
+        Parameters
+        ----------
+            masses    : Masses (in GeV), one per source
+            jfactors  : Astrophysical factors (GeV**2/cm**5),
+                        one per source
+            redshifts : Redshifts, one per source
+            energies  : Energies (in GeV). If None, use
+                        the energies of the instance
+            xmax      : If not None, energies above xmax * mass
+                        are masked for every source
+
+        Return
+        ------
+            dphide : Array (n_sources, n_energy)
+        """
+
+        masses , jfactors , redshifts = np.broadcast_arrays(
+            np.atleast_1d( np.asarray( masses , dtype=float ) ) ,
+            np.atleast_1d( np.asarray( jfactors , dtype=float ) ) ,
+            np.atleast_1d( np.asarray( redshifts , dtype=float ) ) )
+
+        #   Get dnde
+        dnde     = self.spectra_sources( masses , redshifts , energies , xmax=xmax )
+
+        #   Get ppfactor for every source
+        ppfactor = self._ppfactor( self._sigmav , masses , self._delta )
+
+        #   Get the flux
+        dphide   = ( ppfactor * jfactors )[ : , np.newaxis ] * dnde
+
+        return dphide
+
+    def _integrals( self , emin , emax , masses , sigmav , jfactor ) :
+        """
+        Return integral photon flux and energy flux,
+        see integral_flux and energy_flux
+        """
+
+        if masses is None :
+
+            masses = self._mass
+
+        if emin is None :
+
+            emin = self._emin
+
+        if emax is None :
+
+            emax = self._emax
+
+        if sigmav is None :
+
+            sigmav = self._sigmav
+
+        if jfactor is None :
+
+            jfactor = self._jfactor
+
+        nphot , wphot = self._spectral_integrals( masses , emin , emax )
+        masses        = np.broadcast_to( masses , nphot.shape )
+
+        #   Get ppfactor for every mass
+        norm = self._ppfactor( np.asarray( sigmav ) , masses , self._delta ) * \
+            np.asarray( jfactor )
+
+        #   Return
+        return norm * nphot , norm * wphot
+
+    def integral_flux( self , emin=None , emax=None , masses=None ,
+        sigmav=None , jfactor=None ) :
+        """
+        Compute the integral photon flux between emin and emax
+        (in photons/cm**2/s). All arguments can be arrays,
+        which are broadcast against each other.
+        See dmspectrum._spectral_integrals for the method
+
+        Parameters
+        ----------
+            emin    : Minimum energy (GeV). Default is the
+                      minimum energy of the instance
+            emax    : Maximum energy (GeV). Default is the
+                      maximum energy of the instance
+            masses  : Masses (GeV). Default is the mass
+                      of the instance
+            sigmav  : Annihilation cross-section (cm**3/s)
+            jfactor : Astrophysical factor (GeV**2/cm**5)
+        """
+
+        #   Return
+        return self._integrals( emin , emax , masses , sigmav , jfactor )[ 0 ]
+
+    def energy_flux( self , emin=None , emax=None , masses=None ,
+        sigmav=None , jfactor=None ) :
+        """
+        Compute the energy flux between emin and emax
+        (in GeV/cm**2/s). All arguments can be arrays,
+        which are broadcast against each other.
+        See dmspectrum._spectral_integrals for the method
+
+        Parameters
+        ----------
+            emin    : Minimum energy (GeV). Default is the
+                      minimum energy of the instance
+            emax    : Maximum energy (GeV). Default is the
+                      maximum energy of the instance
+            masses  : Masses (GeV). Default is the mass
+                      of the instance
+            sigmav  : Annihilation cross-section (cm**3/s)
+            jfactor : Astrophysical factor (GeV**2/cm**5)
+        """
+
+        #   Return
+        return self._integrals( emin , emax , masses , sigmav , jfactor )[ 1 ]
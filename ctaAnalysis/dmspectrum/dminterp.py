@@ -0,0 +1,135 @@
+#=======================================#
+#   Bilinear interpolation over regular #
+#   (not necessarily uniform) 2D grids  #
+#=======================================#
+import numpy as np
+
+class GridInterp2D() :
+    """
+    Vectorized bilinear interpolation over a rectilinear grid.
+
+    The grid cell of every point is found with searchsorted
+    and the value is the bilinear combination of the four
+    nodes of the cell. Values can have trailing dimensions
+    (for example, one column per channel), which are
+    interpolated with the same weights.
+    """
+
+    def __init__( self , xaxis , yaxis , values , fill_value=None , logx=False ) :
+        """
+        Initialize interpolator
+
+        Parameters
+        ----------
+            xaxis      : Increasing values of first axis
+            yaxis      : Increasing values of second axis
+            values     : Array with shape (nx, ny, ...)
+            fill_value : Value returned outside the grid.
+                         If None, points are clamped to the
+                         edges of the grid
+            logx       : If True, interpolation in first axis
+                         is computed in log10( x )
+        """
+
+        xaxis  = np.array( xaxis , dtype=float )
+        yaxis  = np.array( yaxis , dtype=float )
+        values = np.array( values , dtype=float )
+
+        if logx :
+
+            xaxis = np.log10( xaxis )
+
+        if xaxis.size < 2 or yaxis.size < 2 :
+
+            raise ValueError( 'Axes must have at least two points' )
+
+        if values.shape[ : 2 ] != ( xaxis.size , yaxis.size ) :
+
+            raise ValueError( ( '\nShape of values {0} '.format( values.shape ) +
+                'does not match axes ({0}, {1})'.format( xaxis.size , yaxis.size ) ) )
+
+        if ( np.diff( xaxis ) <= 0 ).any() or ( np.diff( yaxis ) <= 0 ).any() :
+
+            raise ValueError( 'Axes must be strictly increasing' )
+
+        self._x      = xaxis
+        self._y      = yaxis
+        self._dx     = np.diff( xaxis )
+        self._dy     = np.diff( yaxis )
+        self._tail   = values.shape[ 2 : ]
+        self._values = values.reshape( xaxis.size * yaxis.size , -1 )
+        self._fill   = fill_value
+        self._logx   = logx
+
+        #   Return
+        return
+
+    @property
+    def nbytes( self ) :
+        """
+        Return memory (in bytes) used by the grid
+        """
+
+        #   Return
+        return ( self._x.nbytes + self._y.nbytes + self._dx.nbytes +
+            self._dy.nbytes + self._values.nbytes )
+
+    @staticmethod
+    def _locate( axis , delta , vals ) :
+        """
+        Return index of the cell and weight of upper node
+        """
+
+        index = np.searchsorted( axis , vals , side='right' ) - 1
+        np.clip( index , 0 , axis.size - 2 , out=index )
+        weight = ( vals - axis[ index ] ) / delta[ index ]
+
+        #   Return
+        return index , weight
+
+    def __call__( self , x , y ) :
+        """
+        Evaluate the interpolation at points (x, y).
+        x and y are broadcast against each other
+
+        Return
+        ------
+            Array with shape broadcast( x , y ).shape + trailing
+            dimensions of values
+        """
+
+        x , y = np.broadcast_arrays( np.asarray( x , dtype=float ) ,
+            np.asarray( y , dtype=float ) )
+        shape = x.shape
+        xf    = x.ravel()
+        yf    = y.ravel()
+
+        if self._logx :
+
+            xf = np.log10( xf )
+
+        ix , tx = self._locate( self._x , self._dx , xf )
+        iy , ty = self._locate( self._y , self._dy , yf )
+
+        if self._fill is None :
+
+            np.clip( tx , 0.0 , 1.0 , out=tx )
+            np.clip( ty , 0.0 , 1.0 , out=ty )
+
+        ny  = self._y.size
+        i00 = ix * ny + iy
+        v   = self._values
+
+        tx  = tx[ : , None ]
+        ty  = ty[ : , None ]
+        out = ( ( 1. - tx ) * ( ( 1. - ty ) * v[ i00 ] + ty * v[ i00 + 1 ] ) +
+            tx * ( ( 1. - ty ) * v[ i00 + ny ] + ty * v[ i00 + ny + 1 ] ) )
+
+        if self._fill is not None :
+
+            outside = ~( ( xf >= self._x[ 0 ] ) & ( xf <= self._x[ -1 ] ) &
+                ( yf >= self._y[ 0 ] ) & ( yf <= self._y[ -1 ] ) )
+            out[ outside ] = self._fill
+
+        #   Return
+        return out.reshape( shape + self._tail )
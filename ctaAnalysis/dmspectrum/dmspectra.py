@@ -1,10 +1,10 @@
 import numpy as np
-from scipy.interpolate import interp2d
-from ebltable.tau_from_model import OptDepth
+from ctaAnalysis.dmspectrum.dmcache import DMINTERP_CACHE , DMCUMUL_CACHE
+from ctaAnalysis.dmspectrum.dmebl import attenuation , ZMIN_ATTEN
+from ctaAnalysis.dmspectrum.dminterp import GridInterp2D
+from ctaAnalysis.dmspectrum.dmtables import load_table
 from ctaAnalysis.tools.misc import ValidnpArray , ValidString , ValidValue
 
-import os
-
 #   List of allowed channels for annihilation of DM
 #   from PPPC4DMID tables
 ALLOWED_CHANNELS = ( 'eL' , 'eR' , 'e' ,
@@ -64,6 +64,8 @@ class dmspectrum() :
         process : Annihilation (anna) or Decay (dec) of
                   dark matter particles
         eblmod  : EBL model used to compute attenuation
+        has_EW  : Boolean to indicate if EW corrections
+                  are taken into account or not
         """
 
         self._energy   = egev
@@ -333,70 +335,171 @@ class dmspectrum() :
 
     @staticmethod
     def _dminterp( dm_channel , has_EW ) :
+        """
+        Return DM interpolating function for a channel.
+        Interpolators are created only once per process and
+        then kept in DMINTERP_CACHE (see dmcache)
+
+        Parameters
+        ----------
+            dm_channel : Channel
+            has_EW     : using EW corrections (True)
+                         or not (False)
+        """
+
+        #   Return
+        return DMINTERP_CACHE.get( ( dm_channel , bool( has_EW ) ) ,
+            dmspectrum._build_dminterp )
+
+    @staticmethod
+    def _build_dminterp( dm_channel , has_EW ) :
         """
         Create DM interpolating function using tables
         from PPPC4DMID project.
+        Tables are read from the binary store in dmtables.
 
-        Interpolation is computed using interp2d from scipy.
-        By default, only using linear interpolation
+        Interpolation is bilinear in ( log10( mass ) , log10x )
+        using GridInterp2D. Outside the tables, the
+        interpolator returns 1.e-40
 
         Parameters
         ----------
             dm_channel : Channel
             has_EW     : using EW corrections (True)
                          or not (False)
+
+        Return
+        ------
+            dminterp : Function of ( mass , log10x ) arrays
         """
 
-        #   Name of file to read data
-        BASEDIR = os.path.abspath( os.path.join( os.path.dirname( __file__ ) , '..' ) )
-        data_path = os.path.join( BASEDIR , 'data/' )
+        #   Memory-mapped table, the text file is only parsed
+        #   when the binary table does not exist or is outdated
+        table = load_table( has_EW )
+
+        #   Interpolating function over the (mDM, Log10x) grid
+        dminterp = GridInterp2D( table.masses , table.logx ,
+            table.block( dm_channel ) , fill_value=1.e-40 , logx=True )
 
-        fname = 'AtProduction'
+        #   Return
+        return dminterp
 
-        if not has_EW :
+    @staticmethod
+    def _dminterp_channels( dm_channels , has_EW ) :
+        """
+        Return DM interpolating function for several channels
+        at once. The interpolator returns one value per channel
+        in the last dimension. Interpolators are kept in
+        DMINTERP_CACHE (see dmcache)
 
-            fname += 'NoEW'
+        Parameters
+        ----------
+            dm_channels : Sequence of channels
+            has_EW      : using EW corrections (True)
+                          or not (False)
+        """
 
-        fname += '_gammas.dat'
-        fname = os.path.join( data_path , fname )
+        #   Return
+        return DMINTERP_CACHE.get( ( tuple( dm_channels ) , bool( has_EW ) ) ,
+            dmspectrum._build_dminterp_channels )
 
-        # print( 'Reading data from {:s}'.format( fname ) )
+    @staticmethod
+    def _build_dminterp_channels( dm_channels , has_EW ) :
+        """
+        Create DM interpolating function for several channels.
+        Columns of all the channels are stacked in one block
+        (nmass, nlogx, nchannels), so they are interpolated
+        with a single lookup
 
-        #   Loading data
-        data = np.genfromtxt( fname , names=True )
+        Parameters
+        ----------
+            dm_channels : Tuple of channels
+            has_EW      : using EW corrections (True)
+                          or not (False)
+        """
 
-        #   Get unique values of masses and logxvals
-        masses   = np.unique( data[ 'mDM' ] )
-        logxvals = np.unique( data[ 'Log10x' ] )
+        for channel in dm_channels :
 
-        #   Matirx to extract data
-        dndlogx  = np.zeros( ( logxvals.size , masses.size ) )
+            if channel not in ALLOWED_CHANNELS :
 
-        #   Filling dndlogx matrix
-        for mindex , mass in enumerate( masses ) :
+                raise ValueError( ( '\nChannel {0} is not valid\n'.format( channel ) +
+                    'Valid options are {0}'.format( ALLOWED_CHANNELS ) ) )
 
-            mass = int( mass )
-            indices = np.where( data[ 'mDM' ] == mass )
-            phis    = data[ dm_channel ][ indices ]
+        table  = load_table( has_EW )
+        blocks = np.stack( [ table.block( channel ) for channel in dm_channels ] ,
+            axis=-1 )
 
-            for index , phi in enumerate( phis ) :
+        #   Return
+        return GridInterp2D( table.masses , table.logx , blocks ,
+            fill_value=1.e-40 , logx=True )
 
-                logxval                    = logxvals[ index ]
-                dndlogx[ index ][ mindex ] = phi
+    @staticmethod
+    def _dmcumul( dm_channel , has_EW ) :
+        """
+        Return interpolating function of the cumulative
+        integrals of the PPPC4DMID tables for a channel.
+        Interpolators are kept in DMCUMUL_CACHE (see dmcache)
 
-        #   Interpolating function using interp2d
-        #   By default, I am only using linear interpolation
-        dminterp = interp2d( masses , logxvals , dndlogx , \
-            kind='linear' , fill_value=1.e-40 )
+        Parameters
+        ----------
+            dm_channel : Channel
+            has_EW     : using EW corrections (True)
+                         or not (False)
+        """
 
         #   Return
-        return dminterp
+        return DMCUMUL_CACHE.get( ( dm_channel , bool( has_EW ) ) ,
+            dmspectrum._build_dmcumul )
+
+    @staticmethod
+    def _build_dmcumul( dm_channel , has_EW ) :
+        """
+        Create interpolating function of the cumulative integrals
+
+            N( < log10x ) = int dN/dlog10x dlog10x
+            X( < log10x ) = int x dN/dlog10x dlog10x
+
+        computed with the trapezoidal rule along every
+        (channel, mass) row of the PPPC4DMID tables.
+        Interpolation is bilinear in ( log10( mass ) , log10x )
+        and values are clamped outside the table, so below the
+        table the integrals are zero and above x=1 they are
+        the total integrals.
+
+        Parameters
+        ----------
+            dm_channel : Channel
+            has_EW     : using EW corrections (True)
+                         or not (False)
+
+        Return
+        ------
+            cumul : Function of ( mass , log10x ) arrays returning
+                    arrays with N and X in the last dimension
+        """
+
+        table   = load_table( has_EW )
+        logx    = np.asarray( table.logx )
+        dndlogx = np.asarray( table.block( dm_channel ) )
+        xdndlogx = dndlogx * np.power( 10. , logx )
+
+        cumul   = np.zeros( dndlogx.shape + ( 2 , ) )
+        dlogx   = np.diff( logx )
+
+        for index , integrand in enumerate( ( dndlogx , xdndlogx ) ) :
+
+            cumul[ : , 1 : , index ] = np.cumsum( 0.5 * dlogx *
+                ( integrand[ : , 1 : ] + integrand[ : , : -1 ] ) , axis=1 )
+
+        #   Return
+        return GridInterp2D( table.masses , logx , cumul , logx=True )
 
     @staticmethod
     def _ebl_atten( z , eblmodel , egev ) :
         """
-        Compute EBL attenuation, using ebl-table project
-        By default, using kx=ky=2 as interpolation order
+        Compute EBL attenuation, using ebl-table project.
+        OptDepth instances are read only once per process
+        (see dmebl)
 
         Parameters
         ----------
@@ -409,18 +512,8 @@ class dmspectrum() :
             atten    : attenuation
         """
 
-        #   Check if redshift is greater than 1.e-3
-        #   if not, then atten = 1
-
-        if z >= 1.e-3 :
-
-            #   Initiate instance of OptDepth
-            tau   = OptDepth.readmodel( eblmodel )
-            atten = np.exp( -1. * tau.opt_depth( z , egev * 1.e-3 ) )
-
-        else :
-
-            atten = 1.0
+        #   If redshift is lower than 1.e-3, then atten = 1
+        atten = attenuation( z , eblmodel , egev )
 
         #   Return
         return atten
@@ -439,7 +532,6 @@ class dmspectrum() :
         #   Compute number of photons at energy self._energy
         xval       = self._energy / self._mass
         dndlogx    = dm_interp( self._mass , np.log10( xval ) )
-        dndlogx    = dndlogx.flatten()
         dnde       = dndlogx / self._energy / np.log( 10 )
 
         #   Return spectrum attenuated by EBL
@@ -448,3 +540,286 @@ class dmspectrum() :
         #   Return
         return dnde_atten
 
+    def _intrinsic_grid( self , masses , energies ) :
+        """
+        Compute dN/dE without EBL attenuation for all pairs
+        ( mass , energy )
+
+        Parameters
+        ----------
+            masses   : 1D array with masses (in GeV)
+            energies : 1D array with energies (in GeV)
+
+        Return
+        ------
+            dnde : Array (n_mass, n_energy)
+        """
+
+        #   Check if masses have valid values
+        if ( masses < 5 ).any() or ( masses > 1.e+5 ).any() :
+
+            raise ValueError( ( '\nSome masses of DM particle ' +
+                'are out of range: [5,1.e+5] GeV' ) )
+
+        #   Get Interpolator
+        dm_interp = self._dminterp( self._channel , self._ew )
+
+        #   Compute number of photons for all pairs (mass, energy)
+        xval      = energies[ np.newaxis , : ] / masses[ : , np.newaxis ]
+        dndlogx   = dm_interp( masses[ : , np.newaxis ] , np.log10( xval ) )
+        dnde      = dndlogx / energies / np.log( 10 )
+
+        #   Return
+        return dnde
+
+    @staticmethod
+    def _mask_cutoff( dnde , masses , energies , xmax ) :
+        """
+        Mask energies above xmax * mass (if xmax is not None)
+        """
+
+        if xmax is not None :
+
+            mask = energies[ np.newaxis , : ] > xmax * masses[ : , np.newaxis ]
+            dnde = np.ma.masked_array( dnde , mask=mask )
+
+        #   Return
+        return dnde
+
+    def spectra_grid( self , masses , energies=None , xmax=None ) :
+        """
+        Compute the dm_spectrum for several masses in one
+        vectorized evaluation. Channel, redshift, EBL model
+        and EW corrections are taken from the instance.
+
+        Parameters
+        ----------
+            masses   : Masses (in GeV) of dark matter particle
+            energies : Energies (in GeV). If None, use
+                       the energies of the instance
+            xmax     : If not None, energies above xmax * mass
+                       are masked for every mass
+                       (for example, xmax=0.95)
+
+        Return
+        ------
+            dnde : Array (n_mass, n_energy). If xmax is not None,
+                   a numpy masked array is returned
+        """
+
+        masses = np.atleast_1d( np.asarray( masses , dtype=float ) )
+
+        if energies is None :
+
+            energies = self._energy
+
+        energies = np.atleast_1d( np.asarray( energies , dtype=float ) )
+
+        #   Compute attenuation, it does not depend on mass
+        atten    = self._ebl_atten( self._z , self._eblmodel , energies )
+
+        dnde     = self._intrinsic_grid( masses , energies ) * atten
+
+        #   Return
+        return self._mask_cutoff( dnde , masses , energies , xmax )
+
+    def spectra_sources( self , masses , redshifts , energies=None , xmax=None ) :
+        """
+        Compute the dm_spectrum for a list of sources, each one
+        with its own mass and redshift. The intrinsic spectrum is
+        computed once per distinct mass and the EBL attenuation
+        once per distinct redshift.
+        Channel, EBL model and EW corrections are taken from
+        the instance.
+
+        Parameters
+        ----------
+            masses    : Masses (in GeV), one per source
+            redshifts : Redshifts, one per source
+            energies  : Energies (in GeV). If None, use
+                        the energies of the instance
+            xmax      : If not None, energies above xmax * mass
+                        are masked for every source
+
+        Return
+        ------
+            dnde : Array (n_sources, n_energy)
+        """
+
+        masses , redshifts = np.broadcast_arrays(
+            np.atleast_1d( np.asarray( masses , dtype=float ) ) ,
+            np.atleast_1d( np.asarray( redshifts , dtype=float ) ) )
+
+        if energies is None :
+
+            energies = self._energy
+
+        energies = np.atleast_1d( np.asarray( energies , dtype=float ) )
+
+        if ( redshifts < 0 ).any() :
+
+            raise ValueError( ( '\nRedshifts must be positive.' ) )
+
+        #   Share calculations between sources
+        #   with the same mass or the same redshift
+        umasses , minv = np.unique( masses , return_inverse=True )
+        uzs , zinv     = np.unique( redshifts , return_inverse=True )
+
+        dnde  = self._intrinsic_grid( umasses , energies )
+        atten = self._ebl_atten( uzs , self._eblmodel , energies )
+
+        dnde  = dnde[ minv ] * atten[ zinv ]
+
+        #   Return
+        return self._mask_cutoff( dnde , masses , energies , xmax )
+
+    def _spectral_integrals( self , masses , emin , emax , nquad=64 ) :
+        """
+        Compute the integrals of the dm_spectrum between
+        emin and emax
+
+            N = int_emin^emax dN/dE dE
+            W = int_emin^emax E dN/dE dE  (in GeV)
+
+        Masses and energy bounds are broadcast against each other.
+
+        Without EBL attenuation (z < 1.e-3), N and W are two
+        lookups in the cumulative tables (see _build_dmcumul).
+        With attenuation, the integrals are computed with a
+        Gauss-Legendre quadrature of nquad nodes in ln( E )
+        between emin and min( emax , mass ), with the cached
+        ebl-table model for the attenuation (see dmebl).
+
+        Return
+        ------
+            N , W : Arrays with the broadcast shape of the inputs
+        """
+
+        masses , emin , emax = np.broadcast_arrays(
+            np.asarray( masses , dtype=float ) ,
+            np.asarray( emin , dtype=float ) ,
+            np.asarray( emax , dtype=float ) )
+
+        #   Check if masses have valid values
+        if ( masses < 5 ).any() or ( masses > 1.e+5 ).any() :
+
+            raise ValueError( ( '\nSome masses of DM particle ' +
+                'are out of range: [5,1.e+5] GeV' ) )
+
+        if self._z < ZMIN_ATTEN :
+
+            cumul = self._dmcumul( self._channel , self._ew )
+            lower = cumul( masses , np.log10( emin / masses ) )
+            upper = cumul( masses , np.log10( emax / masses ) )
+
+            nphot = upper[ ... , 0 ] - lower[ ... , 0 ]
+            wphot = ( upper[ ... , 1 ] - lower[ ... , 1 ] ) * masses
+
+        else :
+
+            #   There are no photons above the mass
+            emax   = np.minimum( emax , masses )
+            lnemin = np.log( emin )
+            lnemax = np.log( np.maximum( emax , emin ) )
+
+            nodes , weights = np.polynomial.legendre.leggauss( nquad )
+
+            half     = 0.5 * ( lnemax - lnemin )[ ... , np.newaxis ]
+            mid      = 0.5 * ( lnemax + lnemin )[ ... , np.newaxis ]
+            egev     = np.exp( mid + half * nodes )
+
+            dm_interp = self._dminterp( self._channel , self._ew )
+            dndlogx   = dm_interp( masses[ ... , np.newaxis ] ,
+                np.log10( egev / masses[ ... , np.newaxis ] ) )
+            atten     = self._ebl_atten( self._z , self._eblmodel , egev )
+
+            #   dN/dE * E = dN/dlog10x / ln(10)
+            integrand = dndlogx / np.log( 10 ) * atten * half
+
+            nphot = np.sum( integrand * weights , axis=-1 )
+            wphot = np.sum( integrand * egev * weights , axis=-1 )
+
+        #   Return
+        return nphot , wphot
+
+    def spectra_channels( self , channels ) :
+        """
+        Compute the dm_spectrum of several channels in one
+        vectorized pass. Mass, energies, redshift, EBL model
+        and EW corrections are taken from the instance.
+
+        Parameters
+        ----------
+            channels : Sequence of channels
+
+        Return
+        ------
+            dnde : Array (n_channels, n_energy)
+        """
+
+        #   Get Interpolator
+        dm_interp = self._dminterp_channels( channels , self._ew )
+
+        #   Compute attenuation
+        atten     = self._ebl_atten( self._z , self._eblmodel , self._energy )
+
+        #   dndlogx has shape (n_energy, n_channels)
+        xval      = self._energy / self._mass
+        dndlogx   = dm_interp( self._mass , np.log10( xval ) )
+        dnde      = dndlogx.T / self._energy / np.log( 10 ) * atten
+
+        #   Return
+        return dnde
+
+    def spectra_mixture( self , branchings , channels=None ) :
+        """
+        Compute the dm_spectrum for a mixture of final states
+
+        Parameters
+        ----------
+            branchings : Dictionary { channel : branching ratio },
+                         or array with branching ratios (n_channels)
+                         or a matrix (n_models, n_channels) to
+                         compute several mixtures at once
+            channels   : Sequence of channels. Required if
+                         branchings is not a dictionary
+
+        Return
+        ------
+            dnde          : Array (n_energy) or (n_models, n_energy)
+                            with the total spectrum
+            contributions : Array (n_channels, n_energy) or
+                            (n_models, n_channels, n_energy) with
+                            the contribution of every channel
+        """
+
+        if isinstance( branchings , dict ) :
+
+            channels   = list( branchings.keys() )
+            branchings = np.array( list( branchings.values() ) , dtype=float )
+
+        elif channels is None :
+
+            raise ValueError( ( '\nchannels must be given when branchings ' +
+                'is not a dictionary' ) )
+
+        branchings = np.asarray( branchings , dtype=float )
+
+        if branchings.shape[ -1 ] != len( channels ) :
+
+            raise ValueError( ( '\nNumber of branching ratios {0} '.format( branchings.shape[ -1 ] ) +
+                'does not match number of channels {0}'.format( len( channels ) ) ) )
+
+        if ( branchings < 0 ).any() :
+
+            raise ValueError( '\nBranching ratios must be positive' )
+
+        #   Spectrum of every channel, computed once
+        dnde_channels = self.spectra_channels( channels )
+
+        #   Mixtures are a matrix product
+        dnde          = branchings @ dnde_channels
+        contributions = branchings[ ... , np.newaxis ] * dnde_channels
+
+        #   Return
+        return dnde , contributions
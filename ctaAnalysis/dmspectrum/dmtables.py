@@ -0,0 +1,343 @@
+#=======================================#
+#   Binary, memory-mapped store for the #
+#   PPPC4DMID tables                    #
+#                                       #
+#   The text tables in data/ remain the #
+#   source of truth. They are converted #
+#   once to a binary file that is then  #
+#   memory-mapped on first use.         #
+#=======================================#
+import numpy as np
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+
+#   Magic string written at the beginning of every binary table
+TABLE_MAGIC = b'PPPCTAB1'
+
+#   Data block is aligned to this number of bytes
+TABLE_ALIGN = 64
+
+#   Environment variable to change the directory where
+#   binary tables (and other cached products) are stored
+CACHE_ENV = 'CTAANALYSIS_CACHE'
+
+#   Tables already mapped in this process
+_TABLES = {}
+
+def cache_dir() :
+    """
+    Return the directory used to store binary tables and other
+    cached products. By default ~/.cache/ctaAnalysis, but it
+    can be changed with the CTAANALYSIS_CACHE environment variable.
+    """
+
+    path = os.environ.get( CACHE_ENV ,
+        os.path.join( os.path.expanduser( '~' ) , '.cache' , 'ctaAnalysis' ) )
+
+    os.makedirs( path , exist_ok=True )
+
+    #   Return
+    return path
+
+def table_paths( has_EW ) :
+    """
+    Return the path to the text table and to its binary version
+
+    Parameters
+    ----------
+        has_EW : using EW corrections (True) or not (False)
+
+    Return
+    ------
+        txtfile , binfile
+    """
+
+    BASEDIR   = os.path.abspath( os.path.join( os.path.dirname( __file__ ) , '..' ) )
+    data_path = os.path.join( BASEDIR , 'data' )
+
+    fname = 'AtProduction'
+
+    if not has_EW :
+
+        fname += 'NoEW'
+
+    txtfile = os.path.join( data_path , fname + '_gammas.dat' )
+    binfile = os.path.join( cache_dir() , fname + '_gammas.bin' )
+
+    #   Return
+    return txtfile , binfile
+
+def _checksum( fname ) :
+    """
+    Compute sha256 checksum of a file
+    """
+
+    sha = hashlib.sha256()
+
+    with open( fname , 'rb' ) as f :
+
+        for chunk in iter( lambda : f.read( 1 << 20 ) , b'' ) :
+
+            sha.update( chunk )
+
+    #   Return
+    return sha.hexdigest()
+
+def _read_header( binfile ) :
+    """
+    Read header of a binary table
+
+    Return
+    ------
+        header : dictionary, or None if the file is not valid
+        offset : Position (in bytes) of the data block
+    """
+
+    try :
+
+        with open( binfile , 'rb' ) as f :
+
+            magic = f.read( len( TABLE_MAGIC ) )
+
+            if magic != TABLE_MAGIC :
+
+                return None , 0
+
+            hsize , = struct.unpack( '<I' , f.read( 4 ) )
+            header  = json.loads( f.read( hsize ).decode( 'ascii' ) )
+
+    except ( OSError , ValueError , struct.error ) :
+
+        return None , 0
+
+    offset = len( TABLE_MAGIC ) + 4 + hsize
+    offset = -( -offset // TABLE_ALIGN ) * TABLE_ALIGN
+
+    #   Return
+    return header , offset
+
+def convert_table( txtfile , binfile ) :
+    """
+    Convert a PPPC4DMID text table to the binary layout.
+
+    The layout is:
+        - magic string and size of the header
+        - header (json) with checksum of the text file,
+          size of axes and list of channels
+        - mass axis (nmass)
+        - log10x axis (nlogx)
+        - one contiguous block (nmass, nlogx) per channel
+    All numbers are stored as little-endian float64.
+
+    Parameters
+    ----------
+        txtfile : Text table from PPPC4DMID project
+        binfile : Name of binary file to create
+    """
+
+    #   Loading data
+    data = np.genfromtxt( txtfile , names=True )
+
+    #   Sort by mass and then by log10x and check
+    #   that the tables are a regular grid
+    data     = data[ np.lexsort( ( data[ 'Log10x' ] , data[ 'mDM' ] ) ) ]
+    masses   = np.unique( data[ 'mDM' ] )
+    logxvals = np.unique( data[ 'Log10x' ] )
+
+    if data.size != masses.size * logxvals.size :
+
+        raise ValueError( ( 'Table {0} is not a regular '.format( txtfile ) +
+            'grid in (mDM, Log10x)' ) )
+
+    channels = [ name for name in data.dtype.names
+        if name not in ( 'mDM' , 'Log10x' ) ]
+
+    header = { 'sha256'   : _checksum( txtfile ) ,
+               'source'   : os.path.basename( txtfile ) ,
+               'nmass'    : int( masses.size ) ,
+               'nlogx'    : int( logxvals.size ) ,
+               'channels' : channels }
+    header = json.dumps( header ).encode( 'ascii' )
+
+    offset = len( TABLE_MAGIC ) + 4 + len( header )
+    padding = -offset % TABLE_ALIGN
+
+    blocks = np.empty( ( len( channels ) , masses.size , logxvals.size ) , dtype='<f8' )
+
+    for index , channel in enumerate( channels ) :
+
+        blocks[ index ] = data[ channel ].reshape( masses.size , logxvals.size )
+
+    #   Write to temporary file and then move to destination,
+    #   so other processes never see a partial file
+    dirname   = os.path.dirname( os.path.abspath( binfile ) )
+    fd , tmp  = tempfile.mkstemp( dir=dirname , suffix='.tmp' )
+
+    try :
+
+        with os.fdopen( fd , 'wb' ) as f :
+
+            f.write( TABLE_MAGIC )
+            f.write( struct.pack( '<I' , len( header ) ) )
+            f.write( header )
+            f.write( b'\0' * padding )
+            f.write( masses.astype( '<f8' ).tobytes() )
+            f.write( logxvals.astype( '<f8' ).tobytes() )
+            f.write( blocks.tobytes() )
+
+        os.replace( tmp , binfile )
+
+    except BaseException :
+
+        if os.path.exists( tmp ) :
+
+            os.remove( tmp )
+
+        raise
+
+    #   Return
+    return
+
+class PPPCTable() :
+    """
+    Memory-mapped PPPC4DMID table.
+
+    Attributes
+    ----------
+        masses   : Mass axis (GeV)
+        logx     : Log10x axis
+        channels : Tuple with names of the channels
+    """
+
+    def __init__( self , binfile ) :
+        """
+        Map binary table into memory
+
+        Parameters
+        ----------
+            binfile : Binary table created with convert_table
+        """
+
+        header , offset = _read_header( binfile )
+
+        if header is None :
+
+            raise ValueError( '{0} is not a valid binary table'.format( binfile ) )
+
+        nmass = header[ 'nmass' ]
+        nlogx = header[ 'nlogx' ]
+        nchan = len( header[ 'channels' ] )
+
+        data = np.memmap( binfile , dtype='<f8' , mode='r' , offset=offset ,
+            shape=( nmass + nlogx + nchan * nmass * nlogx , ) )
+
+        self._file     = binfile
+        self._sha256   = header[ 'sha256' ]
+        self._channels = tuple( header[ 'channels' ] )
+        self._masses   = data[ : nmass ]
+        self._logx     = data[ nmass : nmass + nlogx ]
+        self._blocks   = data[ nmass + nlogx : ].reshape( nchan , nmass , nlogx )
+
+        #   Return
+        return
+
+    @property
+    def masses( self ) :
+        """
+        Return mass axis (GeV)
+        """
+
+        #   Return
+        return self._masses
+
+    @property
+    def logx( self ) :
+        """
+        Return log10x axis
+        """
+
+        #   Return
+        return self._logx
+
+    @property
+    def channels( self ) :
+        """
+        Return channels in the table
+        """
+
+        #   Return
+        return self._channels
+
+    @property
+    def sha256( self ) :
+        """
+        Return checksum of the text table used to create
+        the binary table
+        """
+
+        #   Return
+        return self._sha256
+
+    def block( self , channel ) :
+        """
+        Return dN/dlog10x for a channel
+
+        Parameters
+        ----------
+            channel : Channel
+
+        Return
+        ------
+            Array (nmass, nlogx), mapped from disk
+        """
+
+        if channel not in self._channels :
+
+            raise ValueError( ( '\nChannel {0} is not in table.\n'.format( channel ) +
+                'Valid options are {0}'.format( self._channels ) ) )
+
+        #   Return
+        return self._blocks[ self._channels.index( channel ) ]
+
+def load_table( has_EW=True ) :
+    """
+    Return the memory-mapped PPPC4DMID table.
+
+    The binary table is created (or rebuilt if the checksum
+    does not match the text table) the first time this function
+    is called in a process. After that, the mapped table
+    is returned directly.
+
+    Parameters
+    ----------
+        has_EW : using EW corrections (True) or not (False)
+
+    Return
+    ------
+        PPPCTable instance
+    """
+
+    has_EW = bool( has_EW )
+
+    if has_EW in _TABLES :
+
+        return _TABLES[ has_EW ]
+
+    txtfile , binfile = table_paths( has_EW )
+    sha256            = _checksum( txtfile )
+    header , offset   = _read_header( binfile )
+
+    if header is None or header.get( 'sha256' ) != sha256 :
+
+        convert_table( txtfile , binfile )
+
+    table = PPPCTable( binfile )
+
+    _TABLES[ has_EW ] = table
+
+    #   Return
+    return table
@@ -1,3 +1,3 @@
 #   Sergio, 2020
 
-__all__ = [ 'misc' , 'createmodels' ]
+__all__ = [ 'misc' , 'createmodels' , 'likeprofile' , 'checkpoint' , 'dmmerge' , 'dmtargets' , 'massgrid' , 'toymc' , 'timing' ]
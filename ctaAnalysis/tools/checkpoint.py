@@ -0,0 +1,166 @@
+#=======================================#
+#   Checkpoint of mass-point results    #
+#                                       #
+#   Results are appended, one JSON      #
+#   object per line, as soon as every   #
+#   mass point is fitted. Every line is #
+#   tagged with a hash of the run       #
+#   parameters, so a re-run with the    #
+#   same parameters skips masses that   #
+#   are already in the file             #
+#=======================================#
+import hashlib
+import json
+import os
+import time
+
+#   Version of the format of the records
+CHECKPOINT_VERSION = 3
+
+def run_hash( params ) :
+    """
+    Return hash (sha256, hex) of a dictionary with the
+    parameters of a run
+
+    Parameters
+    ----------
+        params : Dictionary with values (as strings)
+                 of parameters
+    """
+
+    text = json.dumps( { 'version' : CHECKPOINT_VERSION , 'params' : params } ,
+        sort_keys=True )
+
+    #   Return
+    return hashlib.sha256( text.encode( 'utf-8' ) ).hexdigest()
+
+def mass_key( mass , channel ) :
+    """
+    Return key used to match a mass value (in GeV)
+    and an annihilation channel
+    """
+
+    #   Return
+    return '{0}:{1:.10e}'.format( channel , mass )
+
+class Checkpoint() :
+    """
+    Append-only checkpoint file with results of mass points.
+
+    Records are written with a single os.write on a file
+    opened with O_APPEND, so parallel processes can append
+    to the same file and monitoring tools can follow it
+    (for example, with tail -f) while the scan runs.
+    """
+
+    def __init__( self , filename , runhash ) :
+        """
+        Initialize checkpoint
+
+        Parameters
+        ----------
+            filename : Name of checkpoint file
+            runhash  : Hash of the parameters of the run
+                       (see run_hash)
+        """
+
+        self._filename = filename
+        self._hash     = runhash
+
+        #   Return
+        return
+
+    @property
+    def filename( self ) :
+        """
+        Return name of checkpoint file
+        """
+
+        #   Return
+        return self._filename
+
+    @property
+    def runhash( self ) :
+        """
+        Return hash of the parameters of the run
+        """
+
+        #   Return
+        return self._hash
+
+    def load( self ) :
+        """
+        Read results of the run from the checkpoint file.
+        Records of other runs and incomplete lines (for
+        example, if the process was killed while writing)
+        are ignored
+
+        Return
+        ------
+            Dictionary { key : result }
+        """
+
+        results = {}
+
+        if not os.path.exists( self._filename ) :
+
+            return results
+
+        with open( self._filename , 'r' ) as f :
+
+            for line in f :
+
+                try :
+
+                    record = json.loads( line )
+
+                except ValueError :
+
+                    continue
+
+                if record.get( 'hash' ) != self._hash :
+
+                    continue
+
+                results[ record[ 'key' ] ] = record[ 'result' ]
+
+        #   Return
+        return results
+
+    def append( self , key , result ) :
+        """
+        Append the result of a mass point
+
+        Parameters
+        ----------
+            key    : Key of the mass point (see mass_key)
+            result : Dictionary with results of the
+                     mass point (JSON serializable)
+        """
+
+        record = { 'hash'   : self._hash ,
+                   'key'    : key ,
+                   'time'   : time.time() ,
+                   'result' : result }
+        line   = ( json.dumps( record , default=float ) + '\n' ).encode( 'utf-8' )
+
+        fd = os.open( self._filename , os.O_RDWR | os.O_APPEND | os.O_CREAT , 0o644 )
+
+        try :
+
+            #   Last line is incomplete if a process was killed
+            #   while writing, so the record starts in a new line
+            size = os.fstat( fd ).st_size
+
+            if size > 0 and os.pread( fd , 1 , size - 1 ) != b'\n' :
+
+                line = b'\n' + line
+
+            os.write( fd , line )
+
+        finally :
+
+            os.close( fd )
+
+        #   Return
+        return
@@ -13,7 +13,7 @@ from ctaAnalysis.tools.misc import ValidValue , ValidString
 
 MODEL_TYPES   = ( 'PointSource' , 'DiffuseSource' )
 SPATIAL_TYPE  = ( 'PointSource' , 'DiffuseMap' )
-SPECTRAL_TYPE = ( 'FileFunction' )
+SPECTRAL_TYPE = ( 'FileFunction' , 'Function' )
 
 class dm_spectral_xml() :
 
@@ -93,6 +93,79 @@ class dm_spectral_xml() :
 
         return xml
 
+class dm_spectral_func() :
+
+    def __init__( self , energies , intensities ,
+        minval=0.0 , maxval=1.e+3 , norm_free=True ) :
+
+        self._spectral_type = 'Function'
+        self._energies      = energies
+        self._intensities   = intensities
+        self._min_val       = minval
+        self._max_val       = maxval
+        self._is_norm_free  = norm_free
+
+    @property
+    def energies( self ) :
+
+        return self._energies
+
+    @property
+    def intensities( self ) :
+
+        return self._intensities
+
+    @property
+    def min( self ) :
+
+        return self._min_val
+
+    @property
+    def max( self ) :
+
+        return self._max_val
+
+    @property
+    def norm_free( self ) :
+
+        return self._is_norm_free
+
+    @staticmethod
+    def _set_funcspectrum( energies , intensities , min_val=0.0 ,
+        max_val=1.e+8 , norm_free=True ) :
+
+        #   Same model as FileFunction, but the nodes are
+        #   appended from memory (energies in MeV and
+        #   intensities in ph/cm2/s/MeV)
+        spectrum = gammalib.GModelSpectralFunc()
+        spectrum.reserve( len( energies ) )
+
+        for energy , intensity in zip( energies , intensities ) :
+
+            spectrum.append( gammalib.GEnergy( float( energy ) , 'MeV' ) ,
+                float( intensity ) )
+
+        norm = spectrum[ 'Normalization' ]
+        norm.range( min_val , max_val )
+        norm.value( 1.0 )
+
+        if norm_free :
+
+            norm.free()
+
+        else :
+
+            norm.fix()
+
+        return spectrum
+
+    def spectral_model( self ) :
+
+        model = self._set_funcspectrum( self._energies , self._intensities ,
+            self._min_val , self._max_val , self._is_norm_free )
+
+        return model
+
 class dm_pointsource_xml() :
 
     def __init__( self , srcra , srcdec , ra_free=False , dec_free=False ) :
@@ -213,7 +286,7 @@ class dm_extended_xml() :
 
     def xml_spatial( self ) :
 
-        xml = self._set_diffmap( map_fits )
+        xml = self._set_diffmap( self._fits )
 
         return xml
 
@@ -253,11 +326,23 @@ class DMModel() :
     @staticmethod
     def _set_model( name , modtype , spectrum , spatial , compute_ts=True ) :
 
+        spat   = spatial.xml_spatial()
+
+        #   Spectral models in memory are attached directly
+        #   to the sky model, without an XML element
+        if isinstance( spectrum , dm_spectral_func ) :
+
+            spatmodel = gammalib.GModelSpatialRegistry().alloc( spat )
+            source    = gammalib.GModelSky( spatmodel , spectrum.spectral_model() )
+            source.name( name )
+            source.tscalc( compute_ts )
+
+            return source
+
         srcxml = gammalib.GXmlElement( ( 'source name="{0}" '.format( name ) +
             'type="{0}" '.format( modtype ) +
             'tscalc="{0}"'.format( int( compute_ts ) ) ) )
         spec   = spectrum.xml_spectrum()
-        spat   = spatial.xml_spatial()
 
         srcxml.append( spec )
         srcxml.append( spat )
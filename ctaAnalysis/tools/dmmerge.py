@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+#=======================================#
+#   Merge DMATTER tables produced by    #
+#   several shards of a csdmatter scan  #
+#   (one table per channel)             #
+#                                       #
+#   Usage:                              #
+#     python dmmerge.py merged.fits \   #
+#       shard0.fits shard1.fits ...     #
+#=======================================#
+import gammalib
+import numpy as np
+
+import argparse
+import sys
+
+#   Header cards that must be the same in all tables
+REFERENCE_CARDS = ( 'PROCESS' , 'CHANNEL' , 'EWCORR' , 'EBLMODEL' , 'REDSHIFT' ,
+    'LOGJ' , 'MMIN' , 'MMAX' , 'MNUMPTS' , 'NTARGETS' , 'ASIMOV' , 'EPRUNE' )
+
+#   Cards copied to the merged table
+COPY_CARDS = ( 'INSTRUME' , 'TELESCOP' ) + REFERENCE_CARDS
+
+def extension_names( filename , prefix='DMATTER' ) :
+    """
+    Return names of the extensions of a FITS file
+    starting with prefix (DMATTER or DMATTER_<channel>)
+    """
+
+    fits  = gammalib.GFits( filename )
+    names = [ fits[ k ].extname() for k in range( fits.size() )
+              if fits[ k ].extname().startswith( prefix ) ]
+    fits.close()
+
+    #   Return
+    return names
+
+def read_table( filename , extname='DMATTER' ) :
+    """
+    Read a DMATTER table
+
+    Parameters
+    ----------
+        filename : Name of FITS file
+        extname  : Name of extension
+
+    Return
+    ------
+        Dictionary with:
+            columns : List with names of columns
+            units   : Dictionary with units of columns
+            values  : Dictionary with numpy arrays
+            cards   : Dictionary with header cards (GFitsHeaderCard)
+    """
+
+    fits   = gammalib.GFits( filename )
+    table  = fits.table( extname )
+    header = table.header()
+
+    columns = []
+    units   = {}
+    values  = {}
+
+    for k in range( table.ncols() ) :
+
+        column = table[ k ]
+        name   = column.name()
+
+        columns.append( name )
+        units[ name ]  = column.unit()
+        values[ name ] = np.array( [ column.real( i ) for i in range( table.nrows() ) ] )
+
+    cards = {}
+
+    for name in COPY_CARDS :
+
+        if header.contains( name ) :
+
+            cards[ name ] = gammalib.GFitsHeaderCard( header[ name ] )
+
+    fits.close()
+
+    #   Return
+    return { 'columns' : columns , 'units' : units , 'values' : values ,
+             'cards' : cards }
+
+def _card_value( table , name ) :
+    """
+    Return value (as string) of a header card of
+    a table, or None if the card is not present
+    """
+
+    card = table[ 'cards' ].get( name )
+
+    #   Return
+    return None if card is None else card.value()
+
+def check_tables( tables , filenames ) :
+    """
+    Check that tables can be merged: same columns, same
+    reference cross-section and same reference parameters
+    (channel, EBL model, ...). Raise RuntimeError otherwise
+    """
+
+    first = tables[ 0 ]
+
+    for table , filename in zip( tables , filenames ) :
+
+        if table[ 'columns' ] != first[ 'columns' ] :
+
+            msg = ( 'Columns of {0} do not match '.format( filename ) +
+                'columns of {0}'.format( filenames[ 0 ] ) )
+            raise RuntimeError( msg )
+
+        for name in REFERENCE_CARDS :
+
+            value    = _card_value( table , name )
+            refvalue = _card_value( first , name )
+
+            if value != refvalue :
+
+                msg = ( '{0} of {1} ({2}) '.format( name , filename , value ) +
+                    'does not match {0} ({1})'.format( filenames[ 0 ] , refvalue ) )
+                raise RuntimeError( msg )
+
+    #   Reference cross-section
+    sigmav = np.concatenate( [ table[ 'values' ][ 'RefCrossSection' ]
+        for table in tables ] )
+
+    if sigmav.size > 0 and not np.allclose( sigmav , sigmav[ 0 ] , rtol=1.e-10 , atol=0.0 ) :
+
+        msg = 'RefCrossSection is not the same in all tables'
+        raise RuntimeError( msg )
+
+    #   Return
+    return
+
+def merge_tables( filenames , extname='DMATTER' ) :
+    """
+    Merge DMATTER tables into one table sorted by mass
+
+    Parameters
+    ----------
+        filenames : List with names of FITS files
+        extname   : Name of extension
+
+    Return
+    ------
+        Dictionary with columns, units, values and cards
+        (see read_table) of the merged table
+    """
+
+    if len( filenames ) == 0 :
+
+        raise RuntimeError( 'No tables to merge' )
+
+    tables = [ read_table( filename , extname ) for filename in filenames ]
+
+    check_tables( tables , filenames )
+
+    first  = tables[ 0 ]
+    values = { name : np.concatenate( [ table[ 'values' ][ name ] for table in tables ] )
+               for name in first[ 'columns' ] }
+
+    #   Every mass point must appear only once
+    masses = values[ 'Mass' ]
+
+    if np.unique( masses ).size != masses.size :
+
+        msg = 'Some mass points appear in more than one table'
+        raise RuntimeError( msg )
+
+    order  = np.argsort( masses )
+    values = { name : column[ order ] for name , column in values.items() }
+
+    #   Return
+    return { 'columns' : first[ 'columns' ] , 'units' : first[ 'units' ] ,
+             'values' : values , 'cards' : first[ 'cards' ] }
+
+def create_table( merged , extname='DMATTER' ) :
+    """
+    Create FITS table from a merged table
+
+    Parameters
+    ----------
+        merged  : Dictionary returned by merge_tables
+        extname : Name of extension
+
+    Return
+    ------
+        GFitsBinTable
+    """
+
+    nrows = merged[ 'values' ][ 'Mass' ].size
+    table = gammalib.GFitsBinTable( nrows )
+    table.extname( extname )
+
+    for name in COPY_CARDS :
+
+        if name in merged[ 'cards' ] :
+
+            table.header().append( merged[ 'cards' ][ name ] )
+
+    for name in merged[ 'columns' ] :
+
+        column = gammalib.GFitsTableDoubleCol( name , nrows )
+        column.unit( merged[ 'units' ][ name ] )
+
+        for i , value in enumerate( merged[ 'values' ][ name ] ) :
+
+            column[ i ] = float( value )
+
+        table.append( column )
+
+    #   Return
+    return table
+
+def main( argv=None ) :
+
+    parser = argparse.ArgumentParser( description=( 'Merge DMATTER tables ' +
+        'of several csdmatter shards' ) )
+    parser.add_argument( 'outfile' , help='Output FITS file' )
+    parser.add_argument( 'infiles' , nargs='+' , help='FITS files of shards' )
+    parser.add_argument( '--extname' , default=None ,
+        help=( 'Name of extension to merge. By default, all DMATTER ' +
+        'extensions (one per channel) are merged' ) )
+    args = parser.parse_args( argv )
+
+    if args.extname is None :
+
+        extnames = extension_names( args.infiles[ 0 ] )
+
+    else :
+
+        extnames = [ args.extname ]
+
+    fits = gammalib.GFits()
+
+    for extname in extnames :
+
+        merged = merge_tables( args.infiles , extname )
+
+        #   Warn if some mass point is missing
+        nmass = merged[ 'cards' ].get( 'MNUMPTS' )
+        nrows = merged[ 'values' ][ 'Mass' ].size
+
+        if nmass is not None and nmass.integer() != nrows :
+
+            print( 'Warning: {0} of {1} mass points in {2}'.format( nrows ,
+                nmass.integer() , extname ) )
+
+        fits.append( create_table( merged , extname ) )
+
+    fits.saveto( args.outfile , True )
+
+    #   Return
+    return 0
+
+if __name__ == '__main__' :
+
+    sys.exit( main() )
@@ -0,0 +1,132 @@
+#=======================================#
+#   List of targets for a joint         #
+#   (stacked) DM analysis               #
+#                                       #
+#   Every line of a targets file has:   #
+#     name  ra  dec  logJ  z            #
+#   ra and dec in degrees, logJ is      #
+#   log10 of the astrophysical factor   #
+#   (GeV**2/cm**5). Fields are          #
+#   separated by spaces or commas and   #
+#   lines starting with # are comments  #
+#=======================================#
+import numpy as np
+
+def read_targets( filename ) :
+    """
+    Read targets file
+
+    Parameters
+    ----------
+        filename : Name of targets file
+
+    Return
+    ------
+        List of dictionaries with keys name, ra, dec, logj and z
+    """
+
+    targets = []
+
+    with open( filename , 'r' ) as f :
+
+        for nline , line in enumerate( f , start=1 ) :
+
+            line = line.split( '#' )[ 0 ].strip()
+
+            if len( line ) == 0 :
+
+                continue
+
+            fields = line.replace( ',' , ' ' ).split()
+
+            if len( fields ) != 5 :
+
+                raise ValueError( ( '\nLine {0} of {1} '.format( nline , filename ) +
+                    'must have 5 fields (name, ra, dec, logJ, z). ' +
+                    'Got {0}'.format( len( fields ) ) ) )
+
+            try :
+
+                target = { 'name' : fields[ 0 ] ,
+                           'ra'   : float( fields[ 1 ] ) ,
+                           'dec'  : float( fields[ 2 ] ) ,
+                           'logj' : float( fields[ 3 ] ) ,
+                           'z'    : float( fields[ 4 ] ) }
+
+            except ValueError :
+
+                raise ValueError( ( '\nLine {0} of {1}: '.format( nline , filename ) +
+                    'ra, dec, logJ and z must be numbers' ) )
+
+            if target[ 'z' ] < 0.0 :
+
+                raise ValueError( ( '\nLine {0} of {1}: '.format( nline , filename ) +
+                    'redshift must be positive' ) )
+
+            targets.append( target )
+
+    names = [ target[ 'name' ] for target in targets ]
+
+    if len( set( names ) ) != len( names ) :
+
+        raise ValueError( '\nNames of targets in {0} must be unique'.format( filename ) )
+
+    if len( targets ) == 0 :
+
+        raise ValueError( '\nNo targets in {0}'.format( filename ) )
+
+    #   Return
+    return targets
+
+def angular_distance( ra1 , dec1 , ra2 , dec2 ) :
+    """
+    Return angular distance (in degrees) between
+    positions (in degrees). Arrays are broadcast
+    """
+
+    ra1 , dec1 , ra2 , dec2 = [ np.radians( np.asarray( value , dtype=float ) )
+        for value in ( ra1 , dec1 , ra2 , dec2 ) ]
+
+    #   Haversine formula
+    sindec = np.sin( 0.5 * ( dec2 - dec1 ) )
+    sinra  = np.sin( 0.5 * ( ra2 - ra1 ) )
+    value  = sindec * sindec + np.cos( dec1 ) * np.cos( dec2 ) * sinra * sinra
+
+    #   Return
+    return np.degrees( 2. * np.arcsin( np.sqrt( np.clip( value , 0.0 , 1.0 ) ) ) )
+
+def assign_targets( names , ras , decs , targets ) :
+    """
+    Assign every observation to a target. An observation is
+    assigned to the target with the same name, or to the
+    nearest target to its pointing otherwise
+
+    Parameters
+    ----------
+        names   : Names of observations
+        ras     : Right ascension of pointings (in degrees)
+        decs    : Declination of pointings (in degrees)
+        targets : List of targets (see read_targets)
+
+    Return
+    ------
+        List with index of target for every observation
+    """
+
+    bynames = { target[ 'name' ] : index for index , target in enumerate( targets ) }
+    tras    = np.array( [ target[ 'ra' ] for target in targets ] )
+    tdecs   = np.array( [ target[ 'dec' ] for target in targets ] )
+    indices = []
+
+    for name , ra , dec in zip( names , ras , decs ) :
+
+        if name in bynames :
+
+            indices.append( bynames[ name ] )
+
+        else :
+
+            indices.append( int( np.argmin( angular_distance( ra , dec , tras , tdecs ) ) ) )
+
+    #   Return
+    return indices
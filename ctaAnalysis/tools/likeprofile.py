@@ -0,0 +1,451 @@
+#=======================================#
+#   Profile likelihood over the         #
+#   normalization of a binned signal    #
+#   template (Poisson statistics)       #
+#                                       #
+#   model = norm * signal + b * bkg     #
+#                                       #
+#   where b is fixed to 1 or profiled   #
+#=======================================#
+import numpy as np
+from scipy.stats import chi2
+
+from ctaAnalysis.tools.timing import clock , add_time
+
+#   Minimum expected counts in a bin, to avoid log(0)
+MIN_MODEL = 1.e-30
+
+#   Tolerance and maximum number of iterations
+#   for Newton iterations
+NEWTON_TOL     = 1.e-10
+NEWTON_MAXITER = 100
+
+def delta_logl( cl=0.95 ) :
+    """
+    Return change of the log-likelihood for an upper limit
+    with confidence level cl (1 dof), as in ctulimit:
+    chi2^-1( cl ) / 2 = erfinv( cl )**2 (1.92 for cl = 0.95)
+
+    Parameters
+    ----------
+        cl : Confidence level
+    """
+
+    #   Return
+    return 0.5 * chi2.ppf( cl , 1 )
+
+def logl( counts , model ) :
+    """
+    Poisson log-likelihood sum( n * log( mu ) - mu ),
+    without the constant term log( n! )
+
+    Parameters
+    ----------
+        counts : Observed counts (..., nbins)
+        model  : Expected counts (..., nbins)
+    """
+
+    model = np.maximum( model , MIN_MODEL )
+
+    #   Return
+    return np.sum( counts * np.log( model ) - model , axis=-1 )
+
+def _fit_bkg( counts , signal , background , norms , bkg_start=None ) :
+    """
+    Return the value of the background scale b that maximizes
+    the likelihood for every normalization in norms (Newton
+    iterations in log( b ), so b is always positive)
+
+    Return
+    ------
+        b     : Array with the shape of norms
+        niter : Number of iterations
+    """
+
+    norms = np.asarray( norms , dtype=float )
+    shape = norms.shape
+    norms = norms.reshape( -1 , 1 )
+
+    if bkg_start is None :
+
+        logb = np.zeros( norms.shape )
+
+    else :
+
+        bkg_start = np.maximum( np.broadcast_to( bkg_start , shape ) , MIN_MODEL )
+        logb      = np.log( bkg_start ).reshape( -1 , 1 )
+
+    niter = 0
+
+    for niter in range( 1 , NEWTON_MAXITER + 1 ) :
+
+        bkg   = np.exp( logb ) * background
+        model = np.maximum( norms * signal + bkg , MIN_MODEL )
+        ratio = counts / model
+
+        #   First and second derivatives with respect to log( b )
+        grad  = np.sum( bkg * ( ratio - 1. ) , axis=-1 , keepdims=True )
+        hess  = grad - np.sum( ratio / model * bkg * bkg , axis=-1 , keepdims=True )
+
+        #   If the function is not concave, use gradient ascent
+        step  = np.where( hess < 0 , -grad / np.where( hess < 0 , hess , -1. ) ,
+            np.sign( grad ) )
+        step  = np.clip( step , -2. , 2. )
+        logb += step
+
+        if ( np.abs( step ) < NEWTON_TOL ).all() :
+
+            break
+
+    #   Return
+    return np.exp( logb ).reshape( shape ) , niter
+
+def profile_logl( counts , signal , background , norms , fit_bkg=False ) :
+    """
+    Compute the profile log-likelihood for an array of
+    normalizations
+
+    Parameters
+    ----------
+        counts     : Observed counts (nbins)
+        signal     : Expected counts of signal for norm=1 (nbins)
+        background : Expected counts of background (nbins)
+        norms      : Array of normalizations
+        fit_bkg    : If True, background is renormalized
+                     for every normalization
+
+    Return
+    ------
+        logl : Array with the shape of norms
+        b    : Background scale for every normalization
+    """
+
+    norms = np.asarray( norms , dtype=float )
+
+    if fit_bkg :
+
+        b , _ = _fit_bkg( counts , signal , background , norms )
+
+    else :
+
+        b = np.ones( norms.shape )
+
+    model = norms[ ... , np.newaxis ] * signal + b[ ... , np.newaxis ] * background
+
+    #   Return
+    return logl( counts , model ) , b
+
+def _best_fit( counts , signal , background , fit_bkg ) :
+    """
+    Maximize the likelihood with respect to the normalization
+    (with norm >= 0) and, optionally, the background scale.
+    Newton iterations on the profile likelihood.
+
+    Return
+    ------
+        norm , b , variance of norm , number of iterations
+    """
+
+    #   Starting value from the excess of counts
+    excess = np.sum( counts - background )
+    norm   = max( excess / max( np.sum( signal ) , MIN_MODEL ) , 0.0 )
+    b      = 1.0
+    niter  = 0
+    var    = np.inf
+
+    for niter in range( 1 , NEWTON_MAXITER + 1 ) :
+
+        if fit_bkg :
+
+            b , _ = _fit_bkg( counts , signal , background , norm , b )
+            b     = float( b )
+
+        model = np.maximum( norm * signal + b * background , MIN_MODEL )
+        ratio = counts / model / model
+
+        #   Gradient and Hessian with respect to ( norm , b )
+        grad  = np.sum( signal * ( counts / model - 1. ) )
+        h_nn  = -np.sum( ratio * signal * signal )
+
+        if fit_bkg :
+
+            h_nb = -np.sum( ratio * signal * background )
+            h_bb = -np.sum( ratio * background * background )
+
+            #   Hessian of the profile likelihood
+            if h_bb < 0 :
+
+                h_nn -= h_nb * h_nb / h_bb
+
+        #   Without counts in the bins of the signal, the
+        #   likelihood is linear in norm and decreasing, so the
+        #   best fit is at the boundary
+        if h_nn == 0 and grad <= 0 :
+
+            norm = 0.0
+            break
+
+        var = -1. / h_nn if h_nn < 0 else np.inf
+
+        step = grad * var if np.isfinite( var ) else abs( norm ) + 1.
+
+        #   Normalization must be positive. If the best fit
+        #   is at the boundary, the iterations stop
+        if norm + step < 0 :
+
+            if norm == 0 :
+
+                break
+
+            step = -norm
+
+        norm += step
+
+        if abs( step ) <= NEWTON_TOL * max( abs( norm ) , np.sqrt( var ) if
+            np.isfinite( var ) else 1. ) :
+
+            break
+
+    if fit_bkg :
+
+        b , _ = _fit_bkg( counts , signal , background , norm , b )
+        b     = float( b )
+
+    #   Return
+    return norm , b , var , niter
+
+def _profile_grad( counts , signal , background , norm , fit_bkg , b=None ) :
+    """
+    Return profile log-likelihood, its derivative with respect
+    to the normalization and the background scale
+    """
+
+    if fit_bkg :
+
+        b , _ = _fit_bkg( counts , signal , background , norm , b )
+        b     = float( b )
+
+    else :
+
+        b = 1.0
+
+    model = np.maximum( norm * signal + b * background , MIN_MODEL )
+    value = np.sum( counts * np.log( model ) - model )
+
+    #   Background is at its maximum, so the derivative
+    #   of the profile is the partial derivative
+    grad  = np.sum( signal * ( counts / model - 1. ) )
+
+    #   Return
+    return value , grad , b
+
+def _upper_limit( counts , signal , background , fit_bkg , norm , var ,
+    target , maxsteps ) :
+    """
+    Find the normalization above the best fit where the profile
+    log-likelihood is equal to target. Newton iterations,
+    safeguarded with bisection once the root is bracketed
+
+    Return
+    ------
+        upper limit , number of steps
+    """
+
+    #   Start from the parabolic approximation
+    sigma  = np.sqrt( var ) if np.isfinite( var ) and var > 0 else 1.0
+    lo     = norm
+    hi     = None
+    value  = norm + max( sigma , 1.e-10 )
+    b      = None
+    nsteps = 0
+
+    while nsteps < maxsteps :
+
+        nsteps += 1
+        logl , grad , b = _profile_grad( counts , signal , background ,
+            value , fit_bkg , b )
+        delta = logl - target
+
+        if delta > 0 :
+
+            lo = value
+
+        else :
+
+            hi = value
+
+        if abs( delta ) < NEWTON_TOL * max( 1. , abs( target ) ) :
+
+            break
+
+        #   Newton step, if it stays inside the bracket
+        new = value - delta / grad if grad < 0 else np.inf
+
+        if hi is None :
+
+            if not np.isfinite( new ) or new <= lo :
+
+                new = norm + 2. * ( value - norm )
+
+        elif not ( lo < new < hi ) :
+
+            new = 0.5 * ( lo + hi )
+
+        if hi is not None and ( hi - lo ) <= NEWTON_TOL * hi :
+
+            break
+
+        value = new
+
+    #   Return
+    return value , nsteps
+
+def norm_profile( counts , signal , background , weights=None , fit_bkg=False ,
+    cl=0.95 , maxsteps=200 ) :
+    """
+    Fit the normalization of a signal template and compute
+    TS, error and upper limit from the profile likelihood
+
+    Parameters
+    ----------
+        counts     : Observed counts
+        signal     : Expected counts of signal for norm=1
+        background : Expected counts of background
+        weights    : Bins with weight <= 0 are ignored
+        fit_bkg    : If True, background is renormalized
+        cl         : Confidence level of the upper limit
+        maxsteps   : Maximum number of steps to find
+                     the upper limit
+
+    Return
+    ------
+        Dictionary with:
+            norm      : Best fit normalization (>= 0)
+            norm_err  : Error on normalization (from curvature)
+            ts        : Test statistic
+            ul        : Upper limit on the normalization (-1 if
+                        the signal template is zero, as the
+                        normalization is not constrained)
+            logl      : Log-likelihood at best fit
+            logl_null : Log-likelihood for norm=0
+            bkg       : Background scale at best fit
+            bkg_null  : Background scale for norm=0
+            niter     : Number of iterations of the fit
+            nsteps    : Number of steps to find the upper limit
+            nfev      : Number of evaluations of the likelihood
+            timing    : Wall and CPU time of the fit (like)
+                        and of the upper limit search (ulimit)
+    """
+
+    counts     = np.ravel( counts ).astype( float )
+    signal     = np.ravel( signal ).astype( float )
+    background = np.ravel( background ).astype( float )
+
+    if weights is not None :
+
+        sel        = np.ravel( weights ) > 0
+        counts     = counts[ sel ]
+        signal     = signal[ sel ]
+        background = background[ sel ]
+
+    timing = {}
+    start  = clock()
+
+    #   Signal template without counts (e.g. all its energy
+    #   layers are pruned): the likelihood does not depend on
+    #   the normalization
+    if not np.sum( signal ) > 0 :
+
+        null_logl , b_null = profile_logl( counts , signal , background ,
+            np.array( [ 0.0 ] ) , fit_bkg )
+        add_time( timing , 'like' , start )
+
+        return { 'norm'      : 0.0 ,
+                 'norm_err'  : 0.0 ,
+                 'ts'        : 0.0 ,
+                 'ul'        : -1.0 ,
+                 'logl'      : float( null_logl[ 0 ] ) ,
+                 'logl_null' : float( null_logl[ 0 ] ) ,
+                 'bkg'       : float( b_null[ 0 ] ) ,
+                 'bkg_null'  : float( b_null[ 0 ] ) ,
+                 'niter'     : 0 ,
+                 'nsteps'    : 0 ,
+                 'nfev'      : 1 ,
+                 'timing'    : timing }
+
+    #   Best fit
+    norm , b , var , niter = _best_fit( counts , signal , background , fit_bkg )
+
+    best_logl , _      = profile_logl( counts , signal , background ,
+        np.array( [ norm ] ) , fit_bkg )
+    null_logl , b_null = profile_logl( counts , signal , background ,
+        np.array( [ 0.0 ] ) , fit_bkg )
+    best_logl = float( best_logl[ 0 ] )
+    null_logl = float( null_logl[ 0 ] )
+
+    add_time( timing , 'like' , start )
+    start = clock()
+
+    #   Upper limit: profile log-likelihood decreases by
+    #   delta_logl( cl ) with respect to the best fit
+    ul , nsteps = _upper_limit( counts , signal , background , fit_bkg ,
+        norm , var , best_logl - delta_logl( cl ) , maxsteps )
+
+    add_time( timing , 'ulimit' , start )
+
+    #   Return
+    return { 'norm'      : norm ,
+             'norm_err'  : np.sqrt( var ) if np.isfinite( var ) else 0.0 ,
+             'ts'        : 2. * ( best_logl - null_logl ) ,
+             'ul'        : ul ,
+             'logl'      : best_logl ,
+             'logl_null' : null_logl ,
+             'bkg'       : b ,
+             'bkg_null'  : float( b_null[ 0 ] ) ,
+             'niter'     : niter ,
+             'nsteps'    : nsteps ,
+             'nfev'      : niter + nsteps + 2 ,
+             'timing'    : timing }
+
+def asimov_bands( median , cl=0.95 ) :
+    """
+    Compute expected upper limits from the upper limit
+    obtained for the Asimov dataset of the background-only
+    hypothesis, using the asymptotic formulae (Cowan et al.,
+    Eur. Phys. J. C 71 (2011) 1554):
+
+        sigma_A    = median / z
+        limit( N ) = sigma_A * ( z + N )
+
+    where z = sqrt( 2 * delta_logl( cl ) ), so the bands
+    follow the same threshold as the upper limits.
+    Negative limits (for N = -2) are set to zero, and all
+    limits are zero if median is not positive (failed
+    upper limit)
+
+    Parameters
+    ----------
+        median : Upper limit for the Asimov dataset
+                 (median expected upper limit)
+        cl     : Confidence level of the upper limit
+
+    Return
+    ------
+        Dictionary with median, p1s, m1s, p2s, m2s
+        (median +/- 1 and 2 standard deviations) and sigma
+    """
+
+    if not median > 0 :
+
+        return { key : 0.0 for key in ( 'median' , 'p1s' , 'm1s' , 'p2s' , 'm2s' , 'sigma' ) }
+
+    zcl   = float( np.sqrt( 2. * delta_logl( cl ) ) )
+    sigma = float( median ) / zcl
+
+    #   Return
+    return { 'median' : float( median ) ,
+             'p1s'    : sigma * ( zcl + 1. ) ,
+             'm1s'    : max( sigma * ( zcl - 1. ) , 0.0 ) ,
+             'p2s'    : sigma * ( zcl + 2. ) ,
+             'm2s'    : max( sigma * ( zcl - 2. ) , 0.0 ) ,
+             'sigma'  : sigma }
@@ -0,0 +1,121 @@
+#=======================================#
+#   Adaptive refinement of the grid of  #
+#   DM masses of a limit curve          #
+#=======================================#
+import numpy as np
+
+#   Intervals narrower than this (in log10 of mass)
+#   are not split
+MIN_DLOGM = 1.e-3
+
+def interval_errors( x , y ) :
+    """
+    Estimate the error of linear interpolation of y( x ) in
+    every interval of the grid, h**2 * |y''| / 8, with the second
+    derivative estimated from divided differences at the nodes
+    of the interval
+
+    Parameters
+    ----------
+        x : Increasing values of the grid
+        y : Values at the nodes
+
+    Return
+    ------
+        Array with size x.size - 1
+    """
+
+    x = np.asarray( x , dtype=float )
+    y = np.asarray( y , dtype=float )
+
+    if x.size < 2 :
+
+        return np.zeros( 0 )
+
+    h = np.diff( x )
+
+    #   Without interior nodes the curvature is unknown
+    if x.size < 3 :
+
+        return np.full( h.size , np.inf )
+
+    slopes = np.diff( y ) / h
+    d2     = np.abs( 2. * np.diff( slopes ) / ( x[ 2 : ] - x[ : -2 ] ) )
+
+    #   Curvature of an interval is the largest one
+    #   of its nodes
+    curv          = np.zeros( h.size )
+    curv[ : -1 ]  = d2
+    curv[ 1 : ]   = np.maximum( curv[ 1 : ] , d2 )
+
+    #   Return
+    return curv * h * h / 8.
+
+def refine( logm , logsv , ts , tol , tstol , maxnew , min_dlogm=MIN_DLOGM ) :
+    """
+    Select new mass points where the limit curve bends most
+    or where TS changes fastest. A new point is inserted at
+    the middle (in log10 of mass) of every interval with an
+    interpolation error of log10( sigmav ) larger than tol,
+    or a change of TS larger than tstol. Intervals are
+    ranked by the ratio of their error to the tolerance
+
+    Parameters
+    ----------
+        logm      : log10 of masses (increasing)
+        logsv     : log10 of the upper limit on sigmav. Points
+                    with non-finite values (failed limits) are
+                    not used to estimate the curvature
+        ts        : TS of every mass point
+        tol       : Tolerance on log10( sigmav )
+        tstol     : Tolerance on the change of TS
+        maxnew    : Maximum number of new points
+        min_dlogm : Intervals narrower than this are not split
+
+    Return
+    ------
+        Array with log10 of new masses (increasing)
+    """
+
+    logm  = np.asarray( logm , dtype=float )
+    logsv = np.asarray( logsv , dtype=float )
+    ts    = np.asarray( ts , dtype=float )
+
+    if maxnew <= 0 or logm.size < 2 :
+
+        return np.zeros( 0 )
+
+    scores = {}
+
+    #   Curvature of the limit curve
+    valid = np.isfinite( logsv )
+
+    if valid.sum() >= 2 :
+
+        x   = logm[ valid ]
+        err = interval_errors( x , logsv[ valid ] ) / tol
+
+        for k in range( x.size - 1 ) :
+
+            key           = ( x[ k ] , x[ k + 1 ] )
+            scores[ key ] = max( scores.get( key , 0.0 ) , err[ k ] )
+
+    #   Change of TS
+    if tstol > 0.0 :
+
+        change = np.abs( np.diff( ts ) ) / tstol
+
+        for k in range( logm.size - 1 ) :
+
+            key           = ( logm[ k ] , logm[ k + 1 ] )
+            scores[ key ] = max( scores.get( key , 0.0 ) , change[ k ] )
+
+    candidates = [ ( score , key ) for key , score in scores.items()
+                   if score > 1.0 and key[ 1 ] - key[ 0 ] > 2. * min_dlogm ]
+    candidates.sort( key=lambda item : -item[ 0 ] )
+
+    new = np.unique( [ 0.5 * ( key[ 0 ] + key[ 1 ] )
+                       for _ , key in candidates[ : maxnew ] ] )
+
+    #   Return
+    return new
@@ -0,0 +1,117 @@
+#=======================================#
+#   Wall and CPU time of the stages of  #
+#   the fit of every mass point         #
+#                                       #
+#   Stages are:                         #
+#     model  : DM spectrum and GModel   #
+#     signal : predicted counts of the  #
+#              DM model (binned cubes)  #
+#     like   : maximum likelihood fit   #
+#     ulimit : upper limit search       #
+#     toys   : toy Monte Carlo          #
+#                                       #
+#   CPU time is the time of the process #
+#   fitting the mass point, so work of  #
+#   child processes is not included     #
+#=======================================#
+import time
+
+#   Stages, in the order they are run
+STAGES = ( 'model' , 'signal' , 'like' , 'ulimit' , 'toys' )
+
+def clock() :
+    """
+    Return wall and CPU time (in seconds)
+    """
+
+    #   Return
+    return time.perf_counter() , time.process_time()
+
+def add_time( timing , stage , start ) :
+    """
+    Add the time elapsed since start to a stage
+
+    Parameters
+    ----------
+        timing : Dictionary { stage : { 'wall' , 'cpu' } }
+        stage  : Name of stage
+        start  : Wall and CPU time at the start of
+                 the stage (see clock)
+    """
+
+    wall , cpu = clock()
+    elapsed    = timing.setdefault( stage , { 'wall' : 0.0 , 'cpu' : 0.0 } )
+
+    elapsed[ 'wall' ] += wall - start[ 0 ]
+    elapsed[ 'cpu' ]  += cpu - start[ 1 ]
+
+    #   Return
+    return
+
+def stage_time( timing , stage , kind='wall' ) :
+    """
+    Return time (wall or cpu) of a stage, 0 if the
+    stage was not run
+    """
+
+    #   Return
+    return timing.get( stage , {} ).get( kind , 0.0 )
+
+def total_time( timing , kind='wall' ) :
+    """
+    Return time (wall or cpu) of all stages
+    """
+
+    #   Return
+    return sum( stage_time( timing , stage , kind ) for stage in STAGES )
+
+def merge( timing , other ) :
+    """
+    Add the times of the stages of other to timing
+    """
+
+    for stage , elapsed in other.items() :
+
+        total = timing.setdefault( stage , { 'wall' : 0.0 , 'cpu' : 0.0 } )
+
+        total[ 'wall' ] += elapsed[ 'wall' ]
+        total[ 'cpu' ]  += elapsed[ 'cpu' ]
+
+    #   Return
+    return
+
+def summary( timings ) :
+    """
+    Summary of the timing of several mass points
+
+    Parameters
+    ----------
+        timings : List of dictionaries { stage : { 'wall' , 'cpu' } }
+
+    Return
+    ------
+        Dictionary { stage : { 'wall' , 'cpu' , 'max' , 'argmax' } }
+        with total wall and CPU time of every stage, and the
+        largest wall time of a mass point (and its index in
+        timings). Stages that were not run are not included
+    """
+
+    result = {}
+
+    for stage in STAGES :
+
+        walls = [ stage_time( timing , stage , 'wall' ) for timing in timings ]
+        cpus  = [ stage_time( timing , stage , 'cpu' ) for timing in timings ]
+
+        if not any( stage in timing for timing in timings ) :
+
+            continue
+
+        argmax          = max( range( len( walls ) ) , key=lambda k : walls[ k ] )
+        result[ stage ] = { 'wall'   : sum( walls ) ,
+                            'cpu'    : sum( cpus ) ,
+                            'max'    : walls[ argmax ] ,
+                            'argmax' : argmax }
+
+    #   Return
+    return result
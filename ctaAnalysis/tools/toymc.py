@@ -0,0 +1,169 @@
+#=======================================#
+#   Toy Monte Carlo of binned           #
+#   background-only datasets to compute #
+#   expected upper limits               #
+#                                       #
+#   Every toy has its own random stream #
+#   spawned from one master seed, so    #
+#   results do not depend on the number #
+#   of processes or on the order in     #
+#   which toys are run                  #
+#=======================================#
+import numpy as np
+from ctaAnalysis.tools.likeprofile import norm_profile
+
+import multiprocessing
+
+#   Percentiles of the median and of the 68% and 95%
+#   containment bands
+BAND_PERCENTILES = { 'median' : 50.0 ,
+                     'm1s'    : 15.865525393145708 ,
+                     'p1s'    : 84.13447460685429 ,
+                     'm2s'    : 2.275013194817921 ,
+                     'p2s'    : 97.72498680518208 }
+
+#   Arrays shared by the toys of a worker process
+_SHARED = {}
+
+def toy_seeds( seed , ntoys ) :
+    """
+    Return independent seed sequences for ntoys toys,
+    spawned from a master seed
+
+    Parameters
+    ----------
+        seed  : Master seed
+        ntoys : Number of toys
+    """
+
+    #   Return
+    return np.random.SeedSequence( seed ).spawn( ntoys )
+
+def _init_worker( background , signal , fit_bkg , cl ) :
+    """
+    Store arrays shared by all the toys of a process
+    """
+
+    _SHARED[ 'background' ] = background
+    _SHARED[ 'signal' ]     = signal
+    _SHARED[ 'fit_bkg' ]    = fit_bkg
+    _SHARED[ 'cl' ]         = cl
+
+    #   Return
+    return
+
+def _run_toys( seeds ) :
+    """
+    Simulate and fit a list of toys
+
+    Return
+    ------
+        List of ( ts , ul , norm ) for every toy
+    """
+
+    background = _SHARED[ 'background' ]
+    results    = []
+
+    for seed in seeds :
+
+        rng     = np.random.default_rng( seed )
+        counts  = rng.poisson( background )
+        profile = norm_profile( counts , _SHARED[ 'signal' ] , background ,
+            fit_bkg=_SHARED[ 'fit_bkg' ] , cl=_SHARED[ 'cl' ] )
+
+        results.append( ( profile[ 'ts' ] , profile[ 'ul' ] , profile[ 'norm' ] ) )
+
+    #   Return
+    return results
+
+def run_toys( background , signal , ntoys , seed , nproc=1 , weights=None ,
+    fit_bkg=False , cl=0.95 , chunksize=None ) :
+    """
+    Simulate background-only datasets (Poisson fluctuations of
+    the expected background counts) and fit the normalization
+    of the signal template for every dataset
+
+    The same seed gives the same datasets, so toys of
+    different signal templates (e.g. masses) share datasets
+
+    Parameters
+    ----------
+        background : Expected counts of background
+        signal     : Expected counts of signal for norm=1
+        ntoys      : Number of toys
+        seed       : Master seed
+        nproc      : Number of processes
+        weights    : Bins with weight <= 0 are ignored
+        fit_bkg    : If True, background is renormalized
+        cl         : Confidence level of the upper limit
+        chunksize  : Number of toys per task. By default,
+                     toys are split in 4 tasks per process
+
+    Return
+    ------
+        Dictionary with arrays (ntoys) runid, ts, ul and norm
+    """
+
+    background = np.ravel( background ).astype( float )
+    signal     = np.ravel( signal ).astype( float )
+
+    if weights is not None :
+
+        sel        = np.ravel( weights ) > 0
+        background = background[ sel ]
+        signal     = signal[ sel ]
+
+    seeds = toy_seeds( seed , ntoys )
+
+    if chunksize is None :
+
+        chunksize = max( 1 , int( np.ceil( ntoys / ( 4. * max( nproc , 1 ) ) ) ) )
+
+    chunks = [ seeds[ k : k + chunksize ] for k in range( 0 , ntoys , chunksize ) ]
+
+    if nproc > 1 and len( chunks ) > 1 :
+
+        with multiprocessing.Pool( nproc , initializer=_init_worker ,
+            initargs=( background , signal , fit_bkg , cl ) ) as pool :
+
+            results = pool.map( _run_toys , chunks )
+
+    else :
+
+        _init_worker( background , signal , fit_bkg , cl )
+        results = [ _run_toys( chunk ) for chunk in chunks ]
+
+    values = np.array( [ value for result in results for value in result ] ,
+        dtype=float ).reshape( -1 , 3 )
+
+    #   Return
+    return { 'runid' : np.arange( 1 , ntoys + 1 ) ,
+             'ts'    : values[ : , 0 ] ,
+             'ul'    : values[ : , 1 ] ,
+             'norm'  : values[ : , 2 ] }
+
+def containment_bands( values ) :
+    """
+    Compute median and 68% and 95% containment bands.
+    Non-finite and negative values (failed upper limits,
+    flagged with -1) are ignored
+
+    Parameters
+    ----------
+        values : Array of values (e.g. upper limits of toys)
+
+    Return
+    ------
+        Dictionary with median, m1s, p1s, m2s and p2s
+    """
+
+    values = np.asarray( values , dtype=float )
+    values = values[ np.isfinite( values ) & ( values >= 0.0 ) ]
+
+    if values.size == 0 :
+
+        return { key : 0.0 for key in BAND_PERCENTILES }
+
+    #   Return
+    return { key : float( np.percentile( values , perc ) )
+             for key , perc in BAND_PERCENTILES.items() }